@@ -0,0 +1,175 @@
+"""
+Benchmarks for configuration parsing, Dockerfile generation and image builds.
+
+    python benchmarks/bench.py run --output baseline.json [--build]
+    python benchmarks/bench.py compare baseline.json current.json [--threshold 0.1]
+
+Parsing and generation run against tests/test_project, tests/dummy_project and a synthetic
+monorepo. With --build (requires docker), build() wall time is measured on a copy of
+tests/dummy_project in cold cache, warm cache and source-only change scenarios.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from dockerpyze.builder import parse_pyproject_toml, generate_docker_file_content, build  # noqa: E402
+
+tests_dir = os.path.join(os.path.dirname(__file__), "..", "tests")
+fixtures = {
+    "test_project": os.path.join(tests_dir, "test_project"),
+    "dummy_project": os.path.join(tests_dir, "dummy_project"),
+}
+
+
+def generate_monorepo(root: str, libs: int = 100, modules: int = 20) -> None:
+    """
+    Poetry project with many path dependencies and application packages.
+    """
+    dependencies = "\n".join(f'lib-{i} = {{path = "libs/lib_{i}", develop = true}}' for i in range(libs))
+    packages = ", ".join(f'{{include = "app_{i}"}}' for i in range(libs))
+    with open(os.path.join(root, "pyproject.toml"), "w") as f:
+        f.write(f"""[tool.poetry]
+name = "monorepo"
+version = "0.1.0"
+authors = ["Monorepo Author"]
+packages = [{packages}]
+
+[tool.poetry.dependencies]
+python = "^3.11"
+{dependencies}
+
+[tool.dpy]
+entrypoint = ["python", "-m", "app_0"]
+apt-packages = ["curl"]
+""")
+    for i in range(libs):
+        for package_dir in [os.path.join(root, "libs", f"lib_{i}", f"lib_{i}"), os.path.join(root, f"app_{i}")]:
+            os.makedirs(package_dir)
+            for m in range(modules):
+                with open(os.path.join(package_dir, f"module_{m}.py"), "w") as f:
+                    f.write(f"VALUE = {m}\n")
+
+
+def _throughput(fn: Callable[[], None], min_seconds: float) -> float:
+    iterations = 0
+    start_time = time.perf_counter()
+    # parse_pyproject_toml prints the detected package manager, keep the output clean
+    with contextlib.redirect_stdout(io.StringIO()):
+        while time.perf_counter() - start_time < min_seconds:
+            fn()
+            iterations += 1
+    return iterations / (time.perf_counter() - start_time)
+
+
+def _wall_time(fn: Callable[[], None]) -> float:
+    start_time = time.perf_counter()
+    fn()
+    return time.perf_counter() - start_time
+
+
+def run_parse_benchmarks(projects: dict[str, str], min_seconds: float) -> dict[str, dict]:
+    metrics = {}
+    for name, path in projects.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            config = parse_pyproject_toml(path)
+        metrics[f"parse_pyproject_toml[{name}]"] = {
+            "value": _throughput(lambda: parse_pyproject_toml(path), min_seconds),
+            "unit": "ops/s",
+            "higher_is_better": True,
+        }
+        metrics[f"generate_docker_file_content[{name}]"] = {
+            "value": _throughput(lambda: generate_docker_file_content(config, path), min_seconds),
+            "unit": "ops/s",
+            "higher_is_better": True,
+        }
+    return metrics
+
+
+def run_build_benchmarks() -> dict[str, dict]:
+    metrics = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        project = os.path.join(tmp, "project")
+        shutil.copytree(fixtures["dummy_project"], project)
+        config = parse_pyproject_toml(project)
+        metrics["build[cold]"] = _wall_time(lambda: build(root_path=project, config=config, no_cache=True))
+        metrics["build[warm]"] = _wall_time(lambda: build(root_path=project, config=config))
+        with open(os.path.join(project, "app", "__init__.py"), "a") as f:
+            f.write(f"\nBENCHMARK = {time.time()}\n")
+        metrics["build[source-only]"] = _wall_time(lambda: build(root_path=project, config=config))
+    return {name: {"value": value, "unit": "s", "higher_is_better": False} for name, value in metrics.items()}
+
+
+def run(output: str, include_build: bool, min_seconds: float) -> None:
+    with tempfile.TemporaryDirectory() as monorepo:
+        generate_monorepo(monorepo)
+        metrics = run_parse_benchmarks({**fixtures, "monorepo": monorepo}, min_seconds)
+    if include_build:
+        metrics.update(run_build_benchmarks())
+    for name, metric in metrics.items():
+        print(f"{name:<60}{metric['value']:>12.2f} {metric['unit']}")
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "metrics": metrics,
+    }
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Stored results to {output} 📄")
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """
+    Names of the metrics that got worse than the baseline by more than threshold (relative).
+    """
+    regressions = []
+    for name, metric in current["metrics"].items():
+        baseline_metric = baseline["metrics"].get(name)
+        if baseline_metric is None or not baseline_metric["value"]:
+            continue
+        change = (metric["value"] - baseline_metric["value"]) / baseline_metric["value"]
+        worse_by = -change if metric["higher_is_better"] else change
+        status = "ok"
+        if worse_by > threshold:
+            status = "❌ regression"
+            regressions.append(name)
+        print(f"{name:<60}{baseline_metric['value']:>12.2f}{metric['value']:>12.2f} {metric['unit']:<6}{change:>+8.1%}  {status}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and store the results")
+    run_parser.add_argument("--output", help="JSON results file", default="benchmark.json")
+    run_parser.add_argument("--build", help="Also measure docker builds", action="store_true")
+    run_parser.add_argument("--min-seconds", help="Minimum duration of each throughput measure", type=float, default=1.0)
+    compare_parser = subparsers.add_parser("compare", help="Compare results with a baseline")
+    compare_parser.add_argument("baseline", help="Baseline JSON results file")
+    compare_parser.add_argument("current", help="Current JSON results file")
+    compare_parser.add_argument("--threshold", help="Relative change flagged as regression", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args.output, args.build, args.min_seconds)
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f"Found {len(regressions)} regressions beyond {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
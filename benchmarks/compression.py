@@ -0,0 +1,105 @@
+"""
+Compare layers export size and decompression time per `compression` codec for a project image.
+
+    python benchmarks/compression.py [--path tests/test_project] [--gzip-level 6] [--zstd-level 3] [--json results.json]
+
+The project is built with build() once per codec (gzip, zstd, estargz), then the compressed layer blobs
+are read back with `docker save`. Requires docker buildx and a docker daemon using the containerd image
+store, the classic store decompresses the layers when loading the image. Decompression is timed with the
+`gzip` and `zstd` command line tools, estargz layers are read as gzip.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+import docker
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from dockerpyze.builder import parse_pyproject_toml, build  # noqa: E402
+
+test_project = os.path.join(os.path.dirname(__file__), "..", "tests", "test_project")
+
+CODECS = ["gzip", "zstd", "estargz"]
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def build_with_compression(path: str, compression: str, level: int) -> str:
+    config = parse_pyproject_toml(path)
+    config.compression = compression
+    config.compression_level = level
+    config.image_tags = [f"compression-{compression}"]
+    build(root_path=path, config=config)
+    return f"{config.image_name}:compression-{compression}"
+
+
+def read_layer_blobs(image_name: str) -> list[bytes]:
+    docker_client = docker.from_env()
+    with tempfile.TemporaryFile() as tmp:
+        for chunk in docker_client.images.get(image_name).save():
+            tmp.write(chunk)
+        tmp.seek(0)
+        with tarfile.open(fileobj=tmp) as image_tar:
+            manifest = json.load(image_tar.extractfile("manifest.json"))
+            blobs = [image_tar.extractfile(layer).read() for layer in manifest[0]["Layers"]]
+    if not all(blob.startswith(GZIP_MAGIC) or blob.startswith(ZSTD_MAGIC) for blob in blobs):
+        raise ValueError(f"The layers of {image_name} are not compressed, the docker daemon must use the "
+                         f"containerd image store to keep the exported layers")
+    return blobs
+
+
+def decompress_seconds(blobs: list[bytes], compression: str) -> float:
+    tool = ["zstd", "-d", "-c"] if compression == "zstd" else ["gzip", "-d", "-c"]
+    start_time = time.perf_counter()
+    for blob in blobs:
+        subprocess.run(tool, input=blob, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start_time
+
+
+def benchmark(path: str, gzip_level: int, zstd_level: int) -> dict[str, dict]:
+    results = {}
+    for compression in CODECS:
+        tool = "zstd" if compression == "zstd" else "gzip"
+        if shutil.which(tool) is None:
+            print(f"{tool} not installed, skipping {compression}")
+            continue
+        level = zstd_level if compression == "zstd" else gzip_level
+        start_time = time.perf_counter()
+        image_name = build_with_compression(path, compression, level)
+        build_time = time.perf_counter() - start_time
+        blobs = read_layer_blobs(image_name)
+        results[compression] = {
+            "compressed_bytes": sum(len(blob) for blob in blobs),
+            "build_seconds": round(build_time, 3),
+            "decompress_seconds": round(decompress_seconds(blobs, compression), 3),
+        }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", help="Project to build", default=test_project)
+    parser.add_argument("--gzip-level", type=int, default=6, help="Level of gzip and estargz")
+    parser.add_argument("--zstd-level", type=int, default=3)
+    parser.add_argument("--json", help="Write results to a JSON file")
+    args = parser.parse_args()
+
+    results = benchmark(args.path, args.gzip_level, args.zstd_level)
+
+    print(f"{'codec':<8}{'size (MB)':>12}{'build (s)':>12}{'decompress (s)':>16}")
+    for name, result in results.items():
+        print(f"{name:<8}{result['compressed_bytes'] / 1024 / 1024:>12.1f}"
+              f"{result['build_seconds']:>12}{result['decompress_seconds']:>16}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
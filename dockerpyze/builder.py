@@ -1,6 +1,8 @@
 import argparse
 import os.path
 import re
+import shlex
+import subprocess
 import sys
 import tempfile
 import time
@@ -27,11 +29,57 @@ class DpyConfiguration:
     build_apt_packages: List[str] = []
     build_poetry_install_args: List[str] = []
     base_image: str = ""
+    runtime_base_image: str = ""
     extra_build_instructions: List[str] = []
     extra_runtime_instructions: List[str] = []
     poetry_version: str = ""
     packages: list[str]
     platform: str = ""
+    reproducible: bool = False
+    compression: str = ""
+    compression_level: str = ""
+    build_parallelism: str = ""
+    build_memory: str = ""
+    build_cpuset_cpus: str = ""
+    layer_strategy: str = ""
+    heavy_packages: List[str] = []
+    heavy_package_threshold_mb: str = ""
+    engine: str = ""
+    wheel_dir: str = ""
+    oci_output: str = ""
+    images: dict[str, dict] = {}
+
+
+class ImageConfiguration:
+    target: str
+    image_name: str
+    image_tags: List[str]
+    entrypoint: List[str]
+    ports: List[int] = []
+    envs: dict[str, str] = {}
+    labels: dict[str, str] = {}
+    runtime_apt_packages: List[str] = []
+    extra_runtime_instructions: List[str] = []
+    runtime_base_image: str = ""
+
+
+class BaseImageInfo:
+    python_executable: Optional[str] = None
+    python_version: Optional[str] = None
+    libc: str = "glibc"
+    has_apt: bool = True
+    has_shell: bool = True
+
+
+class LockedPackage:
+    name: str
+    version: str
+    size: Optional[int] = None
+
+
+class DependencyLayer:
+    name: str
+    packages: dict[str, str]
 
 
 class ProjectConfiguration:
@@ -45,6 +93,7 @@ class ProjectConfiguration:
     build_poetry_install_args: List[str] = []
     runtime_apt_packages: List[str] = []
     base_image: str = ""
+    runtime_base_image: str = ""
     extra_build_instructions: List[str] = []
     extra_runtime_instructions: List[str] = []
     deps_packages: List[str] = []
@@ -52,6 +101,18 @@ class ProjectConfiguration:
     poetry_version: str = ""
     package_manager: Literal["uv", "poetry"]
     platform: str = ""
+    reproducible: bool = False
+    compression: Optional[Literal["gzip", "zstd", "estargz"]] = None
+    compression_level: Optional[int] = None
+    build_parallelism: int = 1
+    build_memory: Optional[int] = None
+    build_cpuset_cpus: Optional[str] = None
+    layer_strategy: Literal["single", "split"] = "single"
+    dependency_layers: List[DependencyLayer] = []
+    engine: Literal["docker", "oci"] = "docker"
+    wheel_dir: Optional[str] = None
+    oci_output: Optional[str] = None
+    images: List[ImageConfiguration] = []
 
 
 
@@ -78,11 +139,26 @@ def parse_toml(from_dict: dict) -> DpyConfiguration:
     config.build_apt_packages = _from_env_or_dict_list_str("build-apt-packages", from_dict)
     config.build_poetry_install_args = _from_env_or_dict_list_str("build-poetry-install-args", from_dict)
     config.base_image = _from_env_or_dict_str("base-image", from_dict)
+    config.runtime_base_image = _from_env_or_dict_str("runtime-base-image", from_dict)
     config.extra_build_instructions = _from_env_or_dict_list_str("extra-build-instructions", from_dict)
     config.extra_runtime_instructions = _from_env_or_dict_list_str("extra-runtime-instructions", from_dict)
     config.poetry_version = _from_env_or_dict_str("poetry-version", from_dict)
     config.packages = _from_env_or_dict_list_str("packages", from_dict)
     config.platform = _from_env_or_dict_str("platform", from_dict)
+    config.reproducible = _from_env_or_dict_bool("reproducible", from_dict)
+    config.compression = _from_env_or_dict_str("compression", from_dict)
+    config.compression_level = _from_env_or_dict_str("compression-level", from_dict)
+    config.build_parallelism = _from_env_or_dict_str("build-parallelism", from_dict)
+    config.build_memory = _from_env_or_dict_str("build-memory", from_dict)
+    config.build_cpuset_cpus = _from_env_or_dict_str("build-cpuset-cpus", from_dict)
+    config.layer_strategy = _from_env_or_dict_str("layer-strategy", from_dict)
+    config.heavy_packages = _from_env_or_dict_list_str("heavy-packages", from_dict, " ")
+    config.heavy_package_threshold_mb = _from_env_or_dict_str("heavy-package-threshold-mb", from_dict)
+    config.engine = _from_env_or_dict_str("engine", from_dict)
+    config.wheel_dir = _from_env_or_dict_str("wheel-dir", from_dict)
+    config.oci_output = _from_env_or_dict_str("oci-output", from_dict)
+    # per-image tables are only read from pyproject.toml, env overrides apply to the top-level section
+    config.images = from_dict.get("images", dict())
     return config
 
 
@@ -96,6 +172,12 @@ def _from_env_or_dict_list_str(key: str, from_dict: dict, split_by: Optional[str
     raw_value = _from_env_or_dict_raw(from_dict, key)
     return _parse_list_str(raw_value, split_by)
 
+def _from_env_or_dict_bool(key: str, from_dict: dict) -> bool:
+    raw_value = _from_env_or_dict_raw(from_dict, key)
+    if isinstance(raw_value, bool):
+        return raw_value
+    return str(raw_value).lower() in ("true", "1", "yes")
+
 def _from_env_or_dict_list_int(key: str, from_dict: dict) -> List[int]:
     raw_value = _from_env_or_dict_raw(from_dict, key)
     as_strings = _parse_list_str(raw_value)
@@ -177,6 +259,9 @@ def parse_pyproject_toml(pyproject_path) -> ProjectConfiguration:
         doc = tomllib.load(f)
 
     config = ProjectConfiguration()
+    # don't append to the class level lists, they would grow at every parse
+    config.app_packages = []
+    config.deps_packages = []
     tool = doc.get('tool', dict())
     tool_poetry = tool.get('poetry', dict())
     project = doc.get('project', dict())
@@ -213,6 +298,9 @@ def parse_pyproject_toml(pyproject_path) -> ProjectConfiguration:
 
     if dpy_section.entrypoint_cmd:
         config.entrypoint = dpy_section.entrypoint_cmd
+    elif dpy_section.images:
+        # each image declares its own entrypoint
+        config.entrypoint = []
     else:
         if 'packages' in tool_poetry:
             packages = tool_poetry['packages']
@@ -227,7 +315,7 @@ entrypoint = "python -m {packages[0]['include']}"
         else:
             config.entrypoint = []
 
-    if not config.entrypoint:
+    if not config.entrypoint and not dpy_section.images:
         raise ValueError('No package found in pyproject.toml and no entrypoint specified in dpy section')
 
     config.runtime_apt_packages = dpy_section.apt_packages or []
@@ -275,6 +363,7 @@ entrypoint = "python -m {packages[0]['include']}"
         config.base_image = f"python:{python_version}-slim-bookworm"
     else:
         config.base_image = f"python:{dpy_section.python}-slim-buster"
+    config.runtime_base_image = dpy_section.runtime_base_image or config.base_image
 
     config.ports = dpy_section.ports or []
     config.envs = dpy_section.envs or {}
@@ -304,11 +393,272 @@ entrypoint = "python -m {packages[0]['include']}"
     config.extra_build_instructions = dpy_section.extra_build_instructions or []
     config.extra_runtime_instructions = dpy_section.extra_runtime_instructions or []
     config.platform = dpy_section.platform or None
-
+    config.reproducible = dpy_section.reproducible
+    if dpy_section.compression and dpy_section.compression not in ("gzip", "zstd", "estargz"):
+        raise ValueError(f"Invalid compression '{dpy_section.compression}', expected one of: gzip, zstd, estargz")
+    config.compression = dpy_section.compression or None
+    config.compression_level = int(dpy_section.compression_level) if dpy_section.compression_level else None
+    config.build_memory = parse_memory(dpy_section.build_memory) if dpy_section.build_memory else None
+    config.build_cpuset_cpus = dpy_section.build_cpuset_cpus or None
+    if dpy_section.build_parallelism:
+        config.build_parallelism = int(dpy_section.build_parallelism)
+        if config.build_parallelism < 1:
+            raise ValueError(f"Invalid build-parallelism '{dpy_section.build_parallelism}', expected at least 1")
+    elif config.build_cpuset_cpus:
+        config.build_parallelism = len(parse_cpuset(config.build_cpuset_cpus))
+    else:
+        config.build_parallelism = available_cpu_count()
+    if config.compression and (config.build_memory or config.build_cpuset_cpus):
+        # docker buildx build has no container limits
+        raise ValueError("'build-memory' and 'build-cpuset-cpus' are not supported with 'compression'")
+    if dpy_section.layer_strategy and dpy_section.layer_strategy not in ("single", "split"):
+        raise ValueError(f"Invalid layer-strategy '{dpy_section.layer_strategy}', expected one of: single, split")
+    config.layer_strategy = dpy_section.layer_strategy or "single"
+    if config.layer_strategy == "split" and not config.reproducible:
+        print("⚠️ layer-strategy = \"split\" without reproducible = true: the layers of heavy packages get new "
+              "digests when they are rebuilt without cache")
+    if config.layer_strategy == "split":
+        threshold_mb = int(dpy_section.heavy_package_threshold_mb) if dpy_section.heavy_package_threshold_mb else 50
+        config.dependency_layers = compute_dependency_layers(read_locked_packages(pyproject_path),
+                                                             dpy_section.heavy_packages, threshold_mb)
+    else:
+        config.dependency_layers = []
+    if dpy_section.engine and dpy_section.engine not in ("docker", "oci"):
+        raise ValueError(f"Invalid engine '{dpy_section.engine}', expected one of: docker, oci")
+    config.engine = dpy_section.engine or "docker"
+    config.wheel_dir = os.path.join(pyproject_path, dpy_section.wheel_dir) if dpy_section.wheel_dir else None
+    config.oci_output = os.path.join(pyproject_path, dpy_section.oci_output) if dpy_section.oci_output else None
+    config.images = [parse_image_toml(target, image_dict, config)
+                     for target, image_dict in dpy_section.images.items()]
+    if config.reproducible and any(image.runtime_apt_packages for image in get_image_targets(config)):
+        print("⚠️ 'apt-packages' are installed from the current apt index, their layer is not reproducible")
 
     return config
 
 
+def _normalize_package_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def read_locked_packages(pyproject_path) -> List[LockedPackage]:
+    """
+    Packages pinned in uv.lock or poetry.lock. The size is the largest wheel, only known with uv.lock.
+    """
+    uv_lock = Path(pyproject_path).joinpath("uv.lock")
+    poetry_lock = Path(pyproject_path).joinpath("poetry.lock")
+    lock_path = uv_lock if uv_lock.exists() else poetry_lock
+    if not lock_path.exists():
+        print("⚠️ No lock file found, all the dependencies will be in the same layer")
+        return []
+    with lock_path.open("rb") as f:
+        lock = tomllib.load(f)
+    packages = []
+    for package_dict in lock.get("package", []):
+        source = package_dict.get("source", dict())
+        # the project itself
+        if "editable" in source or "virtual" in source:
+            continue
+        package = LockedPackage()
+        package.name = _normalize_package_name(package_dict["name"])
+        package.version = package_dict.get("version", "")
+        sizes = [wheel["size"] for wheel in package_dict.get("wheels", []) if "size" in wheel]
+        package.size = max(sizes) if sizes else None
+        packages.append(package)
+    return packages
+
+
+KNOWN_HEAVY_PACKAGES = ["jaxlib", "numpy", "onnxruntime", "opencv-python", "opencv-python-headless", "pandas",
+                        "pyarrow", "scipy", "tensorflow", "torch", "torchaudio", "torchvision", "triton"]
+MAX_DEPENDENCY_LAYERS = 32
+
+
+def compute_dependency_layers(
+        packages: List[LockedPackage],
+        heavy_packages: List[str],
+        threshold_mb: int
+) -> List[DependencyLayer]:
+    """
+    One layer for each heavy package, sorted by name, and one layer for all the other packages.
+    Heavy packages are the ones configured, the known ones (e.g. torch, nvidia-*) and the ones
+    with wheels bigger than the threshold.
+    The assignment only depends on the package names and sizes, so that bumping a package only changes its layer.
+    """
+    configured_heavy = [_normalize_package_name(name) for name in heavy_packages]
+
+    def is_heavy(package: LockedPackage) -> bool:
+        return (package.name in configured_heavy
+                or package.name in KNOWN_HEAVY_PACKAGES
+                or package.name.startswith("nvidia-")
+                or (package.size is not None and package.size >= threshold_mb * 1024 * 1024))
+
+    heavy = sorted((package for package in packages if is_heavy(package)), key=lambda package: package.name)
+    # keep some room for the base image and the runtime instructions layers
+    rest = heavy[MAX_DEPENDENCY_LAYERS - 1:]
+    heavy = heavy[:MAX_DEPENDENCY_LAYERS - 1]
+    heavy_names = [package.name for package in heavy]
+    rest += [package for package in packages if package.name not in heavy_names]
+
+    layers = []
+    for package in heavy:
+        layer = DependencyLayer()
+        layer.name = f"deps-{package.name}"
+        layer.packages = {package.name: package.version}
+        layers.append(layer)
+    layer = DependencyLayer()
+    layer.name = "venv"
+    layer.packages = {package.name: package.version for package in sorted(rest, key=lambda package: package.name)}
+    layers.append(layer)
+    return layers
+
+
+def parse_memory(value: str) -> int:
+    match = re.match(r"^(\d+)([bkmg]?)b?$", value.strip().lower())
+    if match is None:
+        raise ValueError(f"Invalid memory '{value}', expected a number of bytes with optional unit (b, k, m, g), e.g. 4g")
+    units = {"": 1, "b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    return int(match.group(1)) * units[match.group(2)]
+
+
+def parse_cpuset(value: str) -> List[int]:
+    cpus = []
+    for part in value.split(","):
+        match = re.match(r"^(\d+)(?:-(\d+))?$", part.strip())
+        if match is None or (match.group(2) is not None and int(match.group(2)) < int(match.group(1))):
+            raise ValueError(f"Invalid cpuset '{value}', expected a list of CPUs or ranges, e.g. 0-7,16")
+        cpus += range(int(match.group(1)), int(match.group(2) or match.group(1)) + 1)
+    return sorted(set(cpus))
+
+
+def available_cpu_count() -> int:
+    # the CPUs this process may run on, not all the CPUs of the host
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+def parse_image_toml(target: str, from_dict: dict, config: ProjectConfiguration) -> ImageConfiguration:
+    if not re.match(r"^[a-z][a-z0-9_.-]*$", target) or target == "builder":
+        raise ValueError(f"Invalid image name '{target}' in 'tool.dpy.images', it must be lowercase alphanumeric and not 'builder'")
+    image = ImageConfiguration()
+    image.target = target
+    image.image_name = from_dict.get("name") or f"{config.image_name}-{target}"
+    # keys set in the image table override the top-level ones, even when empty (e.g. `ports = []`)
+    image.image_tags = _parse_list_str(from_dict["tags"], None) if "tags" in from_dict else config.image_tags
+    if not image.image_tags:
+        raise ValueError(f"No tags specified for image '{target}', please specify 'tags' in 'tool.dpy.images.{target}' section")
+    image.entrypoint = _parse_list_str(from_dict["entrypoint"], None) if "entrypoint" in from_dict else config.entrypoint
+    if not image.entrypoint:
+        raise ValueError(f"No entrypoint specified for image '{target}', please specify 'entrypoint' in 'tool.dpy.images.{target}' section")
+    image.ports = [int(p) for p in _parse_list_str(from_dict["ports"])] if "ports" in from_dict else config.ports
+    image.envs = {**config.envs, **from_dict.get("env", dict())}
+    image.labels = {**config.labels, "org.opencontainers.image.title": image.image_name, **from_dict.get("labels", dict())}
+    image.runtime_apt_packages = (_parse_list_str(from_dict["apt-packages"], None) if "apt-packages" in from_dict
+                                  else config.runtime_apt_packages)
+    image.extra_runtime_instructions = (_parse_list_str(from_dict["extra-runtime-instructions"], None)
+                                        if "extra-runtime-instructions" in from_dict else config.extra_runtime_instructions)
+    image.runtime_base_image = from_dict.get("runtime-base-image") or config.runtime_base_image
+    return image
+
+
+def get_image_targets(config: ProjectConfiguration) -> List[ImageConfiguration]:
+    if config.images:
+        return config.images
+    image = ImageConfiguration()
+    image.target = "runtime"
+    image.image_name = config.image_name
+    image.image_tags = config.image_tags
+    image.entrypoint = config.entrypoint
+    image.ports = config.ports
+    image.envs = config.envs
+    image.labels = config.labels
+    image.runtime_apt_packages = config.runtime_apt_packages
+    image.extra_runtime_instructions = config.extra_runtime_instructions
+    image.runtime_base_image = config.runtime_base_image
+    return [image]
+
+
+def describe_base_image(base_image: str) -> Optional[BaseImageInfo]:
+    """
+    Describe the python installation of well known base images, None if the image is unknown.
+    """
+    repository, _, tag = base_image.partition("@")[0].rpartition(":")
+    if not repository or "/" in tag:
+        repository, tag = base_image.partition("@")[0], "latest"
+    info = BaseImageInfo()
+    if repository == "python" or (repository.endswith("/python") and "chainguard" not in repository):
+        match = re.match(r"^(\d\.\d+)", tag)
+        info.python_version = match.group(1) if match else None
+        info.python_executable = f"/usr/local/bin/python{info.python_version}" if info.python_version else None
+        if "alpine" in tag:
+            info.libc = "musl"
+            info.has_apt = False
+        return info
+    if "distroless/python3" in repository:
+        debian_versions = {"debian11": "3.9", "debian12": "3.11"}
+        match = re.search(r"debian\d+", repository)
+        info.python_version = debian_versions.get(match.group(0)) if match else None
+        info.python_executable = f"/usr/bin/python{info.python_version}" if info.python_version else None
+        info.has_apt = False
+        info.has_shell = tag.startswith("debug")
+        return info
+    if "chainguard/python" in repository:
+        info.has_apt = False
+        info.has_shell = "dev" in tag
+        return info
+    return None
+
+
+def validate_builder_base_image(config: ProjectConfiguration) -> None:
+    builder_info = describe_base_image(config.base_image)
+    if builder_info is None:
+        return
+    # the builder stage runs pip and apt-get
+    if not builder_info.has_shell or not builder_info.has_apt:
+        raise ValueError(f"Base image {config.base_image} can't be used for the builder stage, it has no "
+                         f"{'shell' if not builder_info.has_shell else 'apt package manager'}. Please use a python "
+                         f"image as 'base-image' and set the smaller image as 'runtime-base-image'")
+
+
+def validate_runtime_base_image(config: ProjectConfiguration, image: ImageConfiguration) -> None:
+    runtime_info = describe_base_image(image.runtime_base_image)
+    if image.runtime_base_image != config.base_image:
+        builder_info = describe_base_image(config.base_image)
+        if (builder_info is None or runtime_info is None
+                or builder_info.python_executable is None or runtime_info.python_executable is None):
+            print(f"⚠️ Could not verify that runtime base image {image.runtime_base_image} is compatible with "
+                  f"builder base image {config.base_image}, make sure the python interpreter is at the same path.")
+        else:
+            if builder_info.libc != runtime_info.libc:
+                raise ValueError(f"Runtime base image {image.runtime_base_image} uses {runtime_info.libc} "
+                                 f"while builder base image {config.base_image} uses {builder_info.libc}")
+            if builder_info.python_version != runtime_info.python_version:
+                raise ValueError(f"Runtime base image {image.runtime_base_image} has python {runtime_info.python_version} "
+                                 f"while builder base image {config.base_image} has python {builder_info.python_version}")
+            if builder_info.python_executable != runtime_info.python_executable:
+                raise ValueError(f"The virtualenv interpreter {builder_info.python_executable} of builder base image "
+                                 f"{config.base_image} is not available in runtime base image {image.runtime_base_image} "
+                                 f"(found {runtime_info.python_executable}), the virtualenv wouldn't run. Please use "
+                                 f"a builder base image with the python interpreter at {runtime_info.python_executable}")
+    validate_runtime_base_image_features(image)
+
+
+def validate_runtime_base_image_features(image: ImageConfiguration) -> None:
+    runtime_info = describe_base_image(image.runtime_base_image)
+    if runtime_info is None:
+        return
+    if image.runtime_apt_packages and not runtime_info.has_apt:
+        raise ValueError(f"Runtime base image {image.runtime_base_image} has no apt package manager, "
+                         f"'apt-packages' can't be installed: {' '.join(image.runtime_apt_packages)}")
+    if not runtime_info.has_shell:
+        if len(image.entrypoint) == 1:
+            raise ValueError(f"Runtime base image {image.runtime_base_image} has no shell, "
+                             f"please specify 'entrypoint' as a list (exec format)")
+        for instruction in image.extra_runtime_instructions:
+            if instruction.strip().upper().startswith("RUN "):
+                raise ValueError(f"Runtime base image {image.runtime_base_image} has no shell, "
+                                 f"'extra-runtime-instructions' can't contain RUN instructions: {instruction}")
+
+
 def generate_extra_instructions_str(instructions: List[str]) -> str:
     if not len(instructions):
         return ""
@@ -318,17 +668,24 @@ def _remove_duplicates(lst: List[str]) -> List[str]:
     # remove duplicates while keeping order
     return list(dict.fromkeys(lst))
 
-def generate_apt_packages_str(apt_packages: List[str]) -> str:
+def generate_apt_packages_str(apt_packages: List[str], reproducible: bool = False) -> str:
     if not len(apt_packages):
         return ""
     apt_packages_str = " ".join(_remove_duplicates(apt_packages))
+    if reproducible:
+        # no dist-upgrade and no apt lists, logs and caches that change at every run
+        upgrade_cmd = ""
+        install_cmd = f"""apt-get -y install {apt_packages_str} \
+     && rm -rf /var/lib/apt/lists/* /var/log/apt /var/log/dpkg.log /var/cache/ldconfig/aux-cache /var/cache/debconf/*-old"""
+    else:
+        upgrade_cmd = "      && apt-get -y dist-upgrade"
+        install_cmd = f"apt-get -y install {apt_packages_str}"
     return f"""
 ARG DEBIAN_FRONTEND=noninteractive
 
 RUN echo 'Acquire::http::Timeout "30";\\nAcquire::http::ConnectionAttemptDelayMsec "2000";\\nAcquire::https::Timeout "30";\\nAcquire::https::ConnectionAttemptDelayMsec "2000";\\nAcquire::ftp::Timeout "30";\\nAcquire::ftp::ConnectionAttemptDelayMsec "2000";\\nAcquire::Retries "15";' > /etc/apt/apt.conf.d/99timeout_and_retries \
-     && apt-get update \
-     && apt-get -y dist-upgrade \
-     && apt-get -y install {apt_packages_str}"""
+     && apt-get update{upgrade_cmd} \
+     && {install_cmd}"""
 
 
 def generate_add_project_toml_str(config: ProjectConfiguration, real_context_path: str) -> str:
@@ -350,14 +707,106 @@ def generate_add_packages_str(config: ProjectConfiguration, real_context_path: s
             print(f"WARNING: {package} not found, skipping it")
     return add_str
 
-def generate_docker_file_content(config: ProjectConfiguration, real_context_path: str) -> str:
-    ports_str = "\n".join([f"EXPOSE {port}" for port in config.ports])
-    if len(config.entrypoint) > 1:
-        cmd_str = "[" + ", ".join(f'"{e}"' for e in config.entrypoint) + "]"
+# Run with the virtualenv python: moves the files of each distribution in /layers/<layer>/<absolute path>,
+# then the rest of the virtualenv in /layers/venv
+SPLIT_LAYERS_SCRIPT = """
+import importlib.metadata
+import os
+import sys
+
+venv = "/app/.venv"
+parents = set()
+for arg in sys.argv[1:]:
+    layer, _, names = arg.partition("=")
+    os.makedirs(f"/layers/{layer}", exist_ok=True)
+    for name in names.split(","):
+        try:
+            dist = importlib.metadata.distribution(name)
+        except importlib.metadata.PackageNotFoundError:
+            print(f"{name} is not installed, layer {layer} will be empty")
+            continue
+        for file in dist.files or []:
+            path = os.path.abspath(dist.locate_file(file))
+            if not path.startswith(venv + "/") or not os.path.lexists(path):
+                continue
+            target = f"/layers/{layer}{path}"
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(path, target)
+            parents.add(os.path.dirname(path))
+for parent in sorted(parents, key=len, reverse=True):
+    while parent.startswith(venv + "/") and os.path.isdir(parent) and not os.listdir(parent):
+        os.rmdir(parent)
+        parent = os.path.dirname(parent)
+os.makedirs("/layers/venv/app", exist_ok=True)
+os.rename(venv, "/layers/venv/app/.venv")
+"""
+
+
+def generate_split_layers_str(config: ProjectConfiguration) -> str:
+    if config.layer_strategy != "split":
+        return ""
+    # the script is written line by line, so that the generated Dockerfile stays readable
+    script_lines = " \\\n".join(f"    {shlex.quote(line)}" for line in SPLIT_LAYERS_SCRIPT.strip("\n").split("\n"))
+    args = " ".join(f"{layer.name}={','.join(layer.packages)}" for layer in config.dependency_layers if layer.name != "venv")
+    return f"""RUN printf '%s\\n' \\
+{script_lines} \\
+    > /tmp/split_layers.py \\
+    && /app/.venv/bin/python /tmp/split_layers.py {args} \\
+    && rm /tmp/split_layers.py"""
+
+
+def generate_copy_app_str(config: ProjectConfiguration) -> str:
+    copy_str = ""
+    if config.layer_strategy == "split":
+        # heavy packages first, then the rest of the virtualenv and the app
+        for layer in config.dependency_layers:
+            copy_str += f"COPY --from=builder /layers/{layer.name}/ /\n"
+    copy_str += "COPY --from=builder /app/ /app/"
+    if config.reproducible:
+        # copying first avoids WORKDIR creating /app with the current time
+        return f"{copy_str}\nWORKDIR /app"
+    return f"WORKDIR /app\n{copy_str}"
+
+
+def generate_package_manager_parallelism_str(config: ProjectConfiguration) -> str:
+    if config.package_manager == "poetry":
+        return """ENV POETRY_INSTALLER_MAX_WORKERS=${BUILD_PARALLELISM}"""
+    return """ENV UV_CONCURRENT_DOWNLOADS=${BUILD_PARALLELISM}
+ENV UV_CONCURRENT_BUILDS=${BUILD_PARALLELISM}"""
+
+
+def generate_runtime_stage_str(config: ProjectConfiguration, image: ImageConfiguration) -> str:
+    validate_runtime_base_image(config, image)
+    ports_str = "\n".join([f"EXPOSE {port}" for port in image.ports])
+    if len(image.entrypoint) > 1:
+        cmd_str = "[" + ", ".join(f'"{e}"' for e in image.entrypoint) + "]"
     else:
-        cmd_str = f'"{config.entrypoint[0]}"'
-    envs_str = "\n".join([f"ENV {key}={value}" for key, value in config.envs.items()])
-    labels_str = "\n".join([f"LABEL {key}={value}" for key, value in config.labels.items()])
+        cmd_str = f'"{image.entrypoint[0]}"'
+    envs_str = "\n".join([f"ENV {key}={value}" for key, value in image.envs.items()])
+    labels_str = "\n".join([f"LABEL {key}={value}" for key, value in image.labels.items()])
+    # the entrypoint of the runtime base image (e.g. python3 in distroless) would wrap CMD
+    entrypoint_str = "ENTRYPOINT []\n" if image.runtime_base_image != config.base_image else ""
+
+    return f"""FROM {image.runtime_base_image} AS {image.target}
+{generate_apt_packages_str(image.runtime_apt_packages, config.reproducible)}
+{labels_str}
+
+ENV PATH="/app/.venv/bin:$PATH"
+ENV PYTHONUNBUFFERED=1
+{envs_str}
+
+{generate_copy_app_str(config)}
+ENV PYTHONPATH="${{PYTHONPATH}}:/app"
+
+{ports_str}
+{generate_extra_instructions_str(image.extra_runtime_instructions)}
+{entrypoint_str}CMD {cmd_str}"""
+
+
+def generate_docker_file_content(config: ProjectConfiguration, real_context_path: str) -> str:
+    validate_builder_base_image(config)
+    # the builder stage is shared, every image target gets its own runtime stage on top of it
+    runtime_stages_str = "\n\n".join(generate_runtime_stage_str(config, image) for image in get_image_targets(config))
 
     if config.package_manager == "poetry":
         pre_apt_commands = f"""RUN pip install poetry=={config.poetry_version}
@@ -370,12 +819,31 @@ ENV POETRY_CACHE_DIR=/tmp/poetry_cache
     else:
         pre_apt_commands = """RUN pip install uv"""
         install_cmd = f"""RUN cd /app && uv sync && uv pip install uv && uv build"""
+    # the parallelism is passed as build arg, so that the generated Dockerfile doesn't depend on the host
+    install_cmd = f"""ARG BUILD_PARALLELISM=1
+ENV MAKEFLAGS="-j${{BUILD_PARALLELISM}}"
+ENV CMAKE_BUILD_PARALLEL_LEVEL=${{BUILD_PARALLELISM}}
+{generate_package_manager_parallelism_str(config)}
+{install_cmd}"""
+    if config.layer_strategy == "split":
+        install_cmd += "\n" + generate_split_layers_str(config)
+    if config.reproducible:
+        # SOURCE_DATE_EPOCH makes the .pyc files hash-based, timestamps are normalized after the install
+        normalize_cmd = "find /app -exec touch --no-dereference --date=@${SOURCE_DATE_EPOCH} {} +"
+        if config.layer_strategy == "split":
+            # the dependency layers don't depend on the commit, so that they are kept across commits and projects
+            normalize_cmd = f"find /layers -exec touch --no-dereference --date=@0 {{}} + && {normalize_cmd}"
+        install_cmd = f"""ARG SOURCE_DATE_EPOCH=0
+ENV SOURCE_DATE_EPOCH=${{SOURCE_DATE_EPOCH}}
+ENV PYTHONHASHSEED=0
+{install_cmd}
+RUN {normalize_cmd}"""
 
     return f"""
 FROM {config.base_image} AS builder
 {pre_apt_commands}
 
-{generate_apt_packages_str(config.build_apt_packages)}
+{generate_apt_packages_str(config.build_apt_packages, config.reproducible)}
 {generate_add_project_toml_str(config, real_context_path)}
 
 {generate_add_packages_str(config, real_context_path)}
@@ -383,45 +851,74 @@ FROM {config.base_image} AS builder
 
 {install_cmd}
 
-FROM {config.base_image} AS runtime
-{generate_apt_packages_str(config.runtime_apt_packages)}
-{labels_str}
-
-ENV PATH="/app/.venv/bin:$PATH"
-ENV PYTHONUNBUFFERED=1
-{envs_str}
-
-WORKDIR /app
-COPY --from=builder /app/ /app/
-ENV PYTHONPATH="${{PYTHONPATH}}:/app"
-
-{ports_str}
-{generate_extra_instructions_str(config.extra_runtime_instructions)}
-CMD {cmd_str}"""
+{runtime_stages_str}"""
 
 
 def entrypoint() -> None:
     parser = argparse.ArgumentParser()
+    parser.add_argument("command", help="'build' the image once or 'watch' the project and rebuild it on changes",
+                        choices=["build", "watch"], nargs="?", default="build")
     parser.add_argument("--path", help="Project root path", default=os.getcwd())
     parser.add_argument("--generate", help="Generate and persist Dockerfile", action="store_true")
     parser.add_argument("--debug", help="Verbose mode", action="store_true")
+    parser.add_argument("--no-cache", help="Do not use the docker cache", action="store_true")
+    parser.add_argument("--run", help="(watch) Restart a container of the image after every build", action="store_true")
     args = parser.parse_args()
-    build_image(args.path, verbose=args.debug, generate=args.generate)
+    if args.command == "watch":
+        from dockerpyze.watch import watch
+        watch(args.path, verbose=args.debug, run=args.run)
+        return
+    build_image(args.path, verbose=args.debug, generate=args.generate, no_cache=args.no_cache)
 
-def build_image(path: str, verbose: bool = False, generate: bool = False) -> None:
+def build_image(path: str, verbose: bool = False, generate: bool = False, no_cache: bool = False) -> None:
     config = parse_pyproject_toml(path)
-    build(config=config, root_path=path, verbose=verbose, generate=generate)
+    build(config=config, root_path=path, verbose=verbose, generate=generate, no_cache=no_cache)
+
+
+def get_source_date_epoch(real_context_path: str) -> int:
+    """
+    Timestamp of the last git commit, 0 if the project is not in a git repository.
+    """
+    # not a file modification time, it would be the checkout time and differ between machines
+    try:
+        result = subprocess.run(["git", "log", "-1", "--format=%ct"], cwd=real_context_path,
+                                capture_output=True, text=True, check=True)
+        return int(result.stdout.strip())
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        print("⚠️ No git commit found, using 0 as SOURCE_DATE_EPOCH")
+        return 0
+
+
+def generate_build_args(config: ProjectConfiguration, real_context_path: str) -> dict[str, str]:
+    build_args = {"BUILD_PARALLELISM": str(config.build_parallelism)}
+    if config.reproducible:
+        build_args["SOURCE_DATE_EPOCH"] = str(get_source_date_epoch(real_context_path))
+    return build_args
+
+
+def generate_container_limits(config: ProjectConfiguration) -> dict[str, Any]:
+    container_limits = {}
+    if config.build_memory:
+        container_limits["memory"] = config.build_memory
+    if config.build_cpuset_cpus:
+        container_limits["cpusetcpus"] = config.build_cpuset_cpus
+    return container_limits
 
 
 def build(
         root_path: str,
         config: ProjectConfiguration,
         verbose: bool = False,
-        generate: bool = False
+        generate: bool = False,
+        no_cache: bool = False
 ) -> None:
     """
     Build a docker image from a poetry project.
     """
+    if config.engine == "oci" and not generate:
+        from dockerpyze.oci import build_oci_image
+        build_oci_image(root_path, config, verbose=verbose)
+        return
 
     with tempfile.NamedTemporaryFile() as tmp:
         dockerfile = tmp.name
@@ -441,36 +938,19 @@ def build(
         dockerignore = os.path.join(real_context_path, ".dockerignore")
         dockerignore_created = write_dockerignore_if_needed(dockerignore)
         try:
-            first_tag = config.image_tags[0]
-            full_image_name = f"{config.image_name}:{first_tag}"
-            print(f"Building image: {full_image_name} 🔨")
             docker_client = docker.from_env()
             start_time = time.time()
-            try:
-                _, decoder = docker_client.images.build(
-                    path=real_context_path,
-                    dockerfile=dockerfile,
-                    tag=full_image_name,
-                    rm=False,
-                    platform=config.platform or None,
-                )
-                if verbose:
-                    print_build_logs(decoder)
-            except BuildError as e:
-                iterable = iter(e.build_log)
-                print("❌ Build failed, printing execution logs:\n\n")
-                print_build_logs(iterable)
-                print("Error: " + str(e))
-                raise e
-
-            for tag in config.image_tags:
-                if tag == first_tag:
-                    continue
-                docker_client.images.get(full_image_name).tag(config.image_name, tag=tag)
+            images = get_image_targets(config)
+            build_args = generate_build_args(config, real_context_path)
+            for i, image in enumerate(images):
+                # only the first target skips the cache, the next ones reuse its builder stage
+                build_image_target(docker_client, real_context_path, dockerfile, config, image, build_args,
+                                   verbose=verbose, no_cache=no_cache and i == 0)
             diff = time.time() - start_time
             print(f"Successfully built images: ✅  ({round(diff, 1)}s)")
-            for tag in config.image_tags:
-                print(f"  - {config.image_name}:{tag}")
+            for image in images:
+                for tag in image.image_tags:
+                    print(f"  - {image.image_name}:{tag}")
         finally:
             if dockerignore_created:
                 try:
@@ -479,6 +959,103 @@ def build(
                     pass
 
 
+def build_image_target(
+        docker_client: docker.DockerClient,
+        real_context_path: str,
+        dockerfile: str,
+        config: ProjectConfiguration,
+        image: ImageConfiguration,
+        build_args: dict[str, str],
+        verbose: bool = False,
+        no_cache: bool = False
+) -> None:
+    """
+    Build a single runtime stage, the builder stage is taken from the docker cache after the first target.
+    """
+    first_tag = image.image_tags[0]
+    full_image_name = f"{image.image_name}:{first_tag}"
+    print(f"Building image: {full_image_name} 🔨")
+    if config.compression:
+        build_image_target_with_buildx(real_context_path, dockerfile, config, image, build_args,
+                                       verbose=verbose, no_cache=no_cache)
+        return
+    try:
+        _, decoder = docker_client.images.build(
+            path=real_context_path,
+            dockerfile=dockerfile,
+            tag=full_image_name,
+            target=image.target,
+            buildargs=build_args,
+            container_limits=generate_container_limits(config),
+            nocache=no_cache,
+            rm=False,
+            platform=config.platform or None,
+        )
+        if verbose:
+            print_build_logs(decoder)
+    except BuildError as e:
+        iterable = iter(e.build_log)
+        print("❌ Build failed, printing execution logs:\n\n")
+        print_build_logs(iterable)
+        print("Error: " + str(e))
+        raise e
+
+    for tag in image.image_tags:
+        if tag == first_tag:
+            continue
+        docker_client.images.get(full_image_name).tag(image.image_name, tag=tag)
+
+
+def generate_buildx_output_str(config: ProjectConfiguration) -> str:
+    output = f"type=docker,compression={config.compression},force-compression=true"
+    if config.compression_level is not None:
+        output += f",compression-level={config.compression_level}"
+    if config.compression in ("zstd", "estargz"):
+        output += ",oci-mediatypes=true"
+    return output
+
+
+def check_buildx_available() -> None:
+    try:
+        result = subprocess.run(["docker", "buildx", "version"], capture_output=True, text=True)
+    except FileNotFoundError:
+        raise ValueError("'compression' requires docker buildx, the docker command was not found")
+    if result.returncode != 0:
+        raise ValueError("'compression' requires docker buildx, please install the docker buildx plugin")
+
+
+def build_image_target_with_buildx(
+        real_context_path: str,
+        dockerfile: str,
+        config: ProjectConfiguration,
+        image: ImageConfiguration,
+        build_args: dict[str, str],
+        verbose: bool = False,
+        no_cache: bool = False
+) -> None:
+    """
+    The docker build API can't choose the layers compression, buildx is required to export them.
+    """
+    check_buildx_available()
+    cmd = ["docker", "buildx", "build", "--file", dockerfile, "--target", image.target,
+           "--output", generate_buildx_output_str(config)]
+    if config.platform:
+        cmd += ["--platform", config.platform]
+    if no_cache:
+        cmd.append("--no-cache")
+    for key, value in build_args.items():
+        cmd += ["--build-arg", f"{key}={value}"]
+    for tag in image.image_tags:
+        cmd += ["--tag", f"{image.image_name}:{tag}"]
+    cmd.append(real_context_path)
+    result = subprocess.run(cmd, capture_output=not verbose, text=True)
+    if result.returncode != 0:
+        print("❌ Build failed, printing execution logs:\n\n")
+        if result.stderr:
+            print(result.stderr)
+        raise BuildError(f"docker buildx build exited with code {result.returncode}", [{"stream": result.stderr or ""}])
+
+
 def print_build_logs(iterable):
     while True:
         try:
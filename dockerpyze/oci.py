@@ -0,0 +1,978 @@
+"""
+Daemonless engine: assemble an OCI image from the locked wheels, without docker.
+"""
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import platform
+import re
+import shutil
+import tarfile
+import tempfile
+import time
+import tomllib
+import urllib.parse
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Any, Callable
+
+import requests
+from poetry.core.version.markers import parse_marker
+
+from dockerpyze.builder import ProjectConfiguration, ImageConfiguration, DependencyLayer, get_image_targets, \
+    describe_base_image, validate_runtime_base_image_features, get_source_date_epoch, _normalize_package_name, \
+    _remove_duplicates
+
+OCI_INDEX = "application/vnd.oci.image.index.v1+json"
+OCI_MANIFEST = "application/vnd.oci.image.manifest.v1+json"
+OCI_CONFIG = "application/vnd.oci.image.config.v1+json"
+OCI_LAYER_GZIP = "application/vnd.oci.image.layer.v1.tar+gzip"
+OCI_LAYER_ZSTD = "application/vnd.oci.image.layer.v1.tar+zstd"
+DOCKER_MANIFEST_LIST = "application/vnd.docker.distribution.manifest.list.v2+json"
+DOCKER_MANIFEST = "application/vnd.docker.distribution.manifest.v2+json"
+DOCKER_LAYER_GZIP = "application/vnd.docker.image.rootfs.diff.tar.gzip"
+
+VENV_PATH = "app/.venv"
+DEFAULT_PATH = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+
+
+class TargetEnvironment:
+    python_version: str
+    python_full_version: str
+    python_executable: str
+    architecture: str
+    machine: str
+    libc: str = "glibc"
+    libc_version: tuple[int, int] = (2, 36)
+
+    def marker_environment(self, extra: str = "") -> dict[str, str]:
+        return {
+            "python_version": self.python_version,
+            "python_full_version": self.python_full_version,
+            "implementation_version": self.python_full_version,
+            "implementation_name": "cpython",
+            "platform_python_implementation": "CPython",
+            "os_name": "posix",
+            "sys_platform": "linux",
+            "platform_system": "Linux",
+            "platform_machine": self.machine,
+            "extra": extra,
+        }
+
+
+class ResolvedWheel:
+    name: str
+    version: str
+    filename: str
+    url: Optional[str] = None
+    sha256: Optional[str] = None
+    path: Optional[str] = None
+
+
+class BaseImage:
+    manifest: dict
+    config: dict
+    read_blob: Callable[[str, str], None]
+
+
+class LayerBlob:
+    digest: str
+    size: int
+    diff_id: str
+    media_type: str
+    created_by: str
+
+
+def _cache_dir() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "dockerpyze")
+
+
+def _blob_path(digest: str) -> str:
+    return os.path.join(_cache_dir(), "blobs", "sha256", digest.split(":", 1)[1])
+
+
+def _sha256_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def check_oci_engine_supported(config: ProjectConfiguration) -> None:
+    reasons = []
+    images = get_image_targets(config)
+    if len(images) > 1:
+        reasons.append("multiple images")
+    if any(image.runtime_apt_packages for image in images):
+        reasons.append("apt-packages")
+    if config.extra_build_instructions:
+        reasons.append("extra-build-instructions")
+    if any(image.extra_runtime_instructions for image in images):
+        reasons.append("extra-runtime-instructions")
+    if config.deps_packages:
+        reasons.append("path dependencies")
+    if config.compression and config.compression != "gzip":
+        reasons.append(f"{config.compression} compression")
+    if reasons:
+        raise ValueError(f"The oci engine doesn't support {', '.join(reasons)}, please use engine = \"docker\"")
+    # no builder stage, the virtualenv uses the interpreter of the runtime base image
+    for image in images:
+        validate_runtime_base_image_features(image)
+
+
+# ---- target environment
+
+def _host_architecture() -> str:
+    machine = platform.machine().lower()
+    return {"x86_64": "amd64", "amd64": "amd64", "aarch64": "arm64", "arm64": "arm64"}.get(machine, machine)
+
+
+def get_target_environment(config: ProjectConfiguration, image: ImageConfiguration, base_image: BaseImage) -> TargetEnvironment:
+    env = TargetEnvironment()
+    env.architecture = config.platform.split("/")[1] if config.platform else _host_architecture()
+    env.machine = {"amd64": "x86_64", "arm64": "aarch64"}.get(env.architecture, env.architecture)
+    base_envs = dict(e.split("=", 1) for e in base_image.config.get("config", dict()).get("Env") or [])
+    info = describe_base_image(image.runtime_base_image)
+    if info is not None and info.python_version and info.python_executable:
+        env.python_version = info.python_version
+        env.python_executable = info.python_executable
+        env.libc = info.libc
+    elif "PYTHON_VERSION" in base_envs:
+        # official python images convention
+        env.python_version = ".".join(base_envs["PYTHON_VERSION"].split(".")[:2])
+        env.python_executable = f"/usr/local/bin/python{env.python_version}"
+    else:
+        raise ValueError(f"Can't find the python version of base image {image.runtime_base_image}, please use engine = \"docker\"")
+    full_version = base_envs.get("PYTHON_VERSION", "")
+    env.python_full_version = full_version if full_version.startswith(env.python_version + ".") else f"{env.python_version}.0"
+    if "alpine" in image.runtime_base_image:
+        env.libc = "musl"
+        env.libc_version = (1, 2)
+    elif "bullseye" in image.runtime_base_image:
+        env.libc_version = (2, 31)
+    elif "buster" in image.runtime_base_image:
+        env.libc_version = (2, 28)
+    return env
+
+
+# ---- wheels resolution
+
+def _marker_matches(marker: Optional[str], env: TargetEnvironment, extras: Optional[set[str]] = None) -> bool:
+    if not marker:
+        return True
+    for extra in sorted(extras or {""}):
+        if parse_marker(marker).validate(env.marker_environment(extra)):
+            return True
+    return False
+
+
+def _parse_wheel_tags(filename: str) -> Optional[tuple[list[str], list[str], list[str]]]:
+    parts = filename[:-len(".whl")].split("-")
+    if not filename.endswith(".whl") or len(parts) not in (5, 6):
+        return None
+    return parts[-3].split("."), parts[-2].split("."), parts[-1].split(".")
+
+
+def _platform_score(platform_tag: str, env: TargetEnvironment) -> Optional[int]:
+    if platform_tag == "any":
+        return 0
+    legacy = {"manylinux1": (2, 5), "manylinux2010": (2, 12), "manylinux2014": (2, 17)}
+    match = re.match(r"^(manylinux1|manylinux2010|manylinux2014)_(.+)$", platform_tag)
+    if match:
+        libc, version, arch = "glibc", legacy[match.group(1)], match.group(2)
+    else:
+        match = re.match(r"^(manylinux|musllinux)_(\d+)_(\d+)_(.+)$", platform_tag)
+        if match is None:
+            return None
+        libc = "glibc" if match.group(1) == "manylinux" else "musl"
+        version, arch = (int(match.group(2)), int(match.group(3))), match.group(4)
+    if libc != env.libc or arch != env.machine or version > env.libc_version:
+        return None
+    # prefer the newest compatible libc
+    return 1000 + version[0] * 100 + version[1]
+
+
+def _python_abi_score(python_tag: str, abi_tag: str, env: TargetEnvironment) -> Optional[int]:
+    major, minor = env.python_version.split(".")
+    match = re.match(r"^(cp|py)(\d)(\d*)$", python_tag)
+    if match is None or match.group(2) != major:
+        return None
+    tag_minor = int(match.group(3)) if match.group(3) else None
+    if tag_minor is not None and tag_minor > int(minor):
+        return None
+    if abi_tag == f"cp{major}{minor}" and match.group(1) == "cp" and tag_minor == int(minor):
+        return 3
+    if abi_tag == "abi3" and match.group(1) == "cp":
+        return 2
+    if abi_tag == "none" and (match.group(1) == "py" or tag_minor == int(minor)):
+        return 1
+    return None
+
+
+def select_wheel(filenames: List[str], env: TargetEnvironment) -> Optional[str]:
+    """
+    The most specific wheel compatible with the target environment, None if there's no compatible wheel.
+    """
+    best = None
+    for filename in sorted(filenames):
+        tags = _parse_wheel_tags(filename)
+        if tags is None:
+            continue
+        python_tags, abi_tags, platform_tags = tags
+        scores = [(abi_score, platform_score)
+                  for python_tag in python_tags for abi_tag in abi_tags for platform_tag in platform_tags
+                  for abi_score in [_python_abi_score(python_tag, abi_tag, env)]
+                  for platform_score in [_platform_score(platform_tag, env)]
+                  if abi_score is not None and platform_score is not None]
+        if scores and (best is None or max(scores) > best[0]):
+            best = (max(scores), filename)
+    return best[1] if best else None
+
+
+def _resolved_wheel(name: str, version: str, candidates: dict[str, tuple[Optional[str], Optional[str]]],
+                    env: TargetEnvironment) -> ResolvedWheel:
+    filename = select_wheel(list(candidates), env)
+    if filename is None:
+        raise ValueError(f"No wheel of {name} {version} is compatible with python {env.python_version} "
+                         f"on linux/{env.architecture} ({env.libc}), please use engine = \"docker\"")
+    wheel = ResolvedWheel()
+    wheel.name = name
+    wheel.version = version
+    wheel.filename = filename
+    wheel.url, wheel.sha256 = candidates[filename]
+    return wheel
+
+
+def resolve_uv_lock(lock: dict, env: TargetEnvironment, groups: List[str]) -> List[ResolvedWheel]:
+    by_name = defaultdict(list)
+    for package in lock.get("package", []):
+        by_name[_normalize_package_name(package["name"])].append(package)
+    roots = [package for package in lock.get("package", [])
+             if "editable" in package.get("source", dict()) or "virtual" in package.get("source", dict())]
+    selected = {}
+    selected_extras = defaultdict(set)
+    queue = []
+
+    def add_dependencies(dependencies: List[dict]) -> None:
+        for dependency in dependencies:
+            if not _marker_matches(dependency.get("marker"), env):
+                continue
+            candidates = by_name[_normalize_package_name(dependency["name"])]
+            if "version" in dependency:
+                candidates = [c for c in candidates if c["version"] == dependency["version"]]
+            if len(candidates) > 1:
+                candidates = [c for c in candidates
+                              if any(_marker_matches(m, env) for m in c.get("resolution-markers", [""]))]
+            if not candidates:
+                raise ValueError(f"Package {dependency['name']} not found in uv.lock")
+            queue.append((candidates[0], set(dependency.get("extra", []))))
+
+    for root in roots:
+        add_dependencies(root.get("dependencies", []))
+        for group in groups:
+            add_dependencies(root.get("dev-dependencies", dict()).get(group, []))
+    while queue:
+        package, extras = queue.pop()
+        key = (package["name"], package.get("version"))
+        if key not in selected:
+            source = package.get("source", dict())
+            if "registry" not in source and "url" not in source:
+                raise ValueError(f"Package {package['name']} is not installed from a registry, please use engine = \"docker\"")
+            selected[key] = package
+            add_dependencies(package.get("dependencies", []))
+        for extra in sorted(extras - selected_extras[key]):
+            add_dependencies(package.get("optional-dependencies", dict()).get(extra, []))
+        selected_extras[key] |= extras
+
+    wheels = []
+    for (name, version), package in sorted(selected.items()):
+        candidates = {}
+        for wheel in package.get("wheels", []):
+            filename = urllib.parse.unquote(wheel["url"].rsplit("/", 1)[-1])
+            candidates[filename] = (wheel["url"], wheel.get("hash", "").removeprefix("sha256:") or None)
+        wheels.append(_resolved_wheel(_normalize_package_name(name), version, candidates, env))
+    return wheels
+
+
+def _parse_requirement(requirement: str) -> tuple[str, set[str], Optional[str]]:
+    match = re.match(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[([^\]]*)\])?[^;]*(;\s*(.*))?$", requirement)
+    if match is None:
+        raise ValueError(f"Invalid requirement: {requirement}")
+    extras = {e.strip() for e in (match.group(3) or "").split(",") if e.strip()}
+    return _normalize_package_name(match.group(1)), extras, match.group(5)
+
+
+def _poetry_install_options(install_args: List[str]) -> dict[str, List[str]]:
+    options = defaultdict(list)
+    option = None
+    for arg in install_args:
+        name, _, value = arg.partition("=")
+        if name in ("-E", "--extras", "--with", "--without", "--only"):
+            option = "--extras" if name == "-E" else name
+            if value:
+                options[option] += re.split(r"[ ,]+", value)
+                option = None
+        elif name == "--all-extras":
+            options["--all-extras"].append("")
+        elif option is not None:
+            options[option] += re.split(r"[ ,]+", arg)
+            option = None
+    return options
+
+
+def resolve_poetry_lock(lock: dict, pyproject: dict, install_args: List[str], env: TargetEnvironment) -> List[ResolvedWheel]:
+    options = _poetry_install_options(install_args)
+    tool_poetry = pyproject.get("tool", dict()).get("poetry", dict())
+    project = pyproject.get("project", dict())
+    extras_map = {**tool_poetry.get("extras", dict()), **lock.get("extras", dict())}
+    extras = set(extras_map) if options.get("--all-extras") else set(options.get("--extras", []))
+
+    groups = {"main": tool_poetry.get("dependencies", dict())}
+    if "dev-dependencies" in tool_poetry:
+        groups["dev"] = tool_poetry["dev-dependencies"]
+    for group_name, group in tool_poetry.get("group", dict()).items():
+        if not group.get("optional", False) or group_name in options.get("--with", []):
+            groups[group_name] = group.get("dependencies", dict())
+    if options.get("--only"):
+        groups = {name: deps for name, deps in groups.items() if name in options["--only"]}
+    groups = {name: deps for name, deps in groups.items() if name not in options.get("--without", [])}
+
+    by_name = defaultdict(list)
+    for package in lock.get("package", []):
+        by_name[_normalize_package_name(package["name"])].append(package)
+    selected = {}
+    selected_extras = defaultdict(set)
+    queue = []
+
+    def add(name: str, dependency_extras: set[str], marker: Optional[str], marker_extras: Optional[set[str]] = None) -> None:
+        if name == "python" or not _marker_matches(marker, env, marker_extras):
+            return
+        candidates = by_name[_normalize_package_name(name)]
+        if len(candidates) > 1:
+            candidates = [c for c in candidates if _package_markers_match(c, env)]
+        if not candidates:
+            raise ValueError(f"Package {name} not found in poetry.lock")
+        queue.append((candidates[0], dependency_extras))
+
+    def add_constraints(name: str, constraints: Any, package_extras: Optional[set[str]] = None,
+                        optional_allowed: Optional[set[str]] = None) -> None:
+        for constraint in constraints if isinstance(constraints, list) else [constraints]:
+            if not isinstance(constraint, dict):
+                add(name, set(), None)
+                continue
+            if any(key in constraint for key in ("git", "path", "url")):
+                raise ValueError(f"Dependency {name} is not installed from a registry, please use engine = \"docker\"")
+            if constraint.get("optional", False) and _normalize_package_name(name) not in (optional_allowed or set()):
+                continue
+            add(name, set(constraint.get("extras", [])), constraint.get("markers"), package_extras)
+
+    root_optional = {_normalize_package_name(dep) for extra in extras for dep in extras_map.get(extra, [])}
+    for dependencies in groups.values():
+        for name, constraints in dependencies.items():
+            add_constraints(name, constraints, optional_allowed=root_optional)
+    for requirement in project.get("dependencies", []):
+        add(*_parse_requirement(requirement))
+    for extra in sorted(extras):
+        for requirement in project.get("optional-dependencies", dict()).get(extra, []):
+            add(*_parse_requirement(requirement))
+
+    while queue:
+        package, package_extras = queue.pop()
+        key = (package["name"], package["version"])
+        new_extras = package_extras - selected_extras[key]
+        if key in selected and not new_extras:
+            continue
+        source = package.get("source", dict())
+        if source.get("type") in ("git", "directory", "file", "url"):
+            raise ValueError(f"Package {package['name']} is not installed from a registry, please use engine = \"docker\"")
+        # poetry.lock has no wheel urls, they are looked up on PyPI
+        if source:
+            raise ValueError(f"Package {package['name']} is installed from source '{source.get('reference')}' "
+                             f"({source.get('url')}), only PyPI is supported, please use engine = \"docker\"")
+        selected[key] = package
+        selected_extras[key] |= package_extras
+        optional_allowed = set()
+        for extra in selected_extras[key]:
+            optional_allowed |= {_parse_requirement(r)[0] for r in package.get("extras", dict()).get(extra, [])}
+        for name, constraints in package.get("dependencies", dict()).items():
+            add_constraints(name, constraints, selected_extras[key], optional_allowed)
+
+    wheels = []
+    for (name, version), package in sorted(selected.items()):
+        candidates = {file["file"]: (file.get("url"), file.get("hash", "").removeprefix("sha256:") or None)
+                      for file in package.get("files", [])}
+        wheels.append(_resolved_wheel(_normalize_package_name(name), version, candidates, env))
+    return wheels
+
+
+def _package_markers_match(package: dict, env: TargetEnvironment) -> bool:
+    markers = package.get("markers")
+    if isinstance(markers, dict):
+        return any(_marker_matches(m, env) for m in markers.values())
+    return _marker_matches(markers, env)
+
+
+def resolve_wheels(config: ProjectConfiguration, real_context_path: str, env: TargetEnvironment) -> List[ResolvedWheel]:
+    uv_lock = Path(real_context_path).joinpath("uv.lock")
+    poetry_lock = Path(real_context_path).joinpath("poetry.lock")
+    with Path(real_context_path).joinpath("pyproject.toml").open("rb") as f:
+        pyproject = tomllib.load(f)
+    if uv_lock.exists():
+        with uv_lock.open("rb") as f:
+            default_groups = pyproject.get("tool", dict()).get("uv", dict()).get("default-groups", ["dev"])
+            return resolve_uv_lock(tomllib.load(f), env, default_groups)
+    if poetry_lock.exists():
+        with poetry_lock.open("rb") as f:
+            return resolve_poetry_lock(tomllib.load(f), pyproject, config.build_poetry_install_args, env)
+    raise ValueError("The oci engine requires a uv.lock or poetry.lock file")
+
+
+# ---- wheels download
+
+def _pypi_wheel_url(wheel: ResolvedWheel) -> str:
+    response = requests.get(f"https://pypi.org/pypi/{wheel.name}/{wheel.version}/json", timeout=30)
+    response.raise_for_status()
+    for file in response.json().get("urls", []):
+        if file["filename"] == wheel.filename:
+            return file["url"]
+    raise ValueError(f"Wheel {wheel.filename} not found on PyPI")
+
+
+def fetch_wheel(wheel: ResolvedWheel, wheel_dir: Optional[str]) -> str:
+    local_path = os.path.join(wheel_dir, wheel.filename) if wheel_dir else None
+    if local_path and os.path.exists(local_path):
+        path = local_path
+    else:
+        path = os.path.join(_cache_dir(), "wheels", wheel.filename)
+        if not os.path.exists(path):
+            url = wheel.url or _pypi_wheel_url(wheel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with requests.get(url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as tmp:
+                    for chunk in response.iter_content(1024 * 1024):
+                        tmp.write(chunk)
+            os.replace(tmp.name, path)
+    if wheel.sha256 and _sha256_file(path) != wheel.sha256:
+        raise ValueError(f"Hash mismatch for {path}, expected sha256:{wheel.sha256}")
+    return path
+
+
+def fetch_wheels(wheels: List[ResolvedWheel], wheel_dir: Optional[str], parallelism: int) -> None:
+    with ThreadPoolExecutor(max_workers=max(parallelism, 1)) as executor:
+        for wheel, path in zip(wheels, executor.map(lambda w: fetch_wheel(w, wheel_dir), wheels)):
+            wheel.path = path
+
+
+# ---- layers
+
+class _HashingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.sha.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+
+class _LayerWriter:
+    """
+    Deterministic tar layer: sorted entries, fixed owner and modification time, parent directories included.
+    """
+
+    def __init__(self, mtime: int):
+        self.mtime = mtime
+        self.entries: dict[str, tuple[str, Any, int]] = {}
+
+    def add_bytes(self, path: str, data: bytes, mode: int = 0o644) -> None:
+        self.entries[path] = ("file", data, mode)
+
+    def add_zip_member(self, path: str, wheel_path: str, member: str, mode: int) -> None:
+        self.entries[path] = ("zip", (wheel_path, member), mode)
+
+    def add_file(self, path: str, source: str, mode: int) -> None:
+        self.entries[path] = ("path", source, mode)
+
+    def add_symlink(self, path: str, target: str) -> None:
+        self.entries[path] = ("symlink", target, 0o777)
+
+    def _tarinfo(self, path: str, kind: int, mode: int) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(path)
+        info.type = kind
+        info.mode = mode
+        info.mtime = self.mtime
+        info.uid = info.gid = 0
+        info.uname = info.gname = "root"
+        return info
+
+    def write(self, created_by: str, media_type: str = OCI_LAYER_GZIP) -> LayerBlob:
+        blobs_dir = os.path.dirname(_blob_path("sha256:0"))
+        os.makedirs(blobs_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=blobs_dir, delete=False) as tmp:
+            compressed = _HashingWriter(tmp)
+            with gzip.GzipFile(fileobj=compressed, mode="wb", mtime=0) as gz:
+                uncompressed = _HashingWriter(gz)
+                with tarfile.open(fileobj=uncompressed, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                    self._write_entries(tar)
+        layer = LayerBlob()
+        layer.digest = f"sha256:{compressed.sha.hexdigest()}"
+        layer.size = compressed.size
+        layer.diff_id = f"sha256:{uncompressed.sha.hexdigest()}"
+        layer.media_type = media_type
+        layer.created_by = created_by
+        os.replace(tmp.name, _blob_path(layer.digest))
+        return layer
+
+    def _write_entries(self, tar: tarfile.TarFile) -> None:
+        written_dirs = set()
+        zips = {}
+        try:
+            for path in sorted(self.entries):
+                parents = Path(path).parents
+                for parent in reversed([str(p) for p in parents if str(p) != "."]):
+                    if parent not in written_dirs:
+                        tar.addfile(self._tarinfo(parent + "/", tarfile.DIRTYPE, 0o755))
+                        written_dirs.add(parent)
+                kind, source, mode = self.entries[path]
+                if kind == "symlink":
+                    info = self._tarinfo(path, tarfile.SYMTYPE, mode)
+                    info.linkname = source
+                    tar.addfile(info)
+                    continue
+                if kind == "zip":
+                    wheel_path, member = source
+                    if wheel_path not in zips:
+                        zips[wheel_path] = zipfile.ZipFile(wheel_path)
+                    data = zips[wheel_path].read(member)
+                elif kind == "path":
+                    with open(source, "rb") as f:
+                        data = f.read()
+                else:
+                    data = source
+                info = self._tarinfo(path, tarfile.REGTYPE, mode)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        finally:
+            for z in zips.values():
+                z.close()
+
+
+def _console_script(entry_point: str) -> bytes:
+    module, _, attr = entry_point.partition(":")
+    attr = attr.split("[")[0].strip()
+    importable = attr.split(".")[0]
+    return f"""#!/{VENV_PATH}/bin/python
+# -*- coding: utf-8 -*-
+import re
+import sys
+from {module.strip()} import {importable}
+if __name__ == "__main__":
+    sys.argv[0] = re.sub(r"(-script\\.pyw|\\.exe)?$", "", sys.argv[0])
+    sys.exit({attr}())
+""".encode("utf-8")
+
+
+def _console_scripts_from_entry_points(data: str) -> dict[str, str]:
+    scripts = {}
+    section = None
+    for line in data.splitlines():
+        line = line.strip()
+        if line.startswith("["):
+            section = line.strip("[]")
+        elif section == "console_scripts" and "=" in line:
+            name, _, value = line.partition("=")
+            scripts[name.strip()] = value.strip()
+    return scripts
+
+
+def add_wheel(layer: _LayerWriter, wheel_path: str, env: TargetEnvironment) -> None:
+    site_packages = f"{VENV_PATH}/lib/python{env.python_version}/site-packages"
+    with zipfile.ZipFile(wheel_path) as z:
+        for info in sorted(z.infolist(), key=lambda i: i.filename):
+            if info.is_dir():
+                continue
+            mode = 0o755 if (info.external_attr >> 16) & 0o111 else 0o644
+            parts = info.filename.split("/")
+            if parts[0].endswith(".data") and len(parts) > 2:
+                scheme, rest = parts[1], "/".join(parts[2:])
+                if scheme in ("purelib", "platlib"):
+                    layer.add_zip_member(f"{site_packages}/{rest}", wheel_path, info.filename, mode)
+                elif scheme == "scripts":
+                    data = z.read(info.filename)
+                    if data.startswith(b"#!python"):
+                        data = f"#!/{VENV_PATH}/bin/python".encode("utf-8") + data[len(b"#!python"):]
+                    layer.add_bytes(f"{VENV_PATH}/bin/{rest}", data, 0o755)
+                elif scheme == "headers":
+                    layer.add_zip_member(f"{VENV_PATH}/include/site/python{env.python_version}/{rest}",
+                                         wheel_path, info.filename, mode)
+                else:
+                    layer.add_zip_member(f"{VENV_PATH}/{rest}", wheel_path, info.filename, mode)
+                continue
+            layer.add_zip_member(f"{site_packages}/{info.filename}", wheel_path, info.filename, mode)
+            if len(parts) == 2 and parts[0].endswith(".dist-info") and parts[1] == "entry_points.txt":
+                scripts = _console_scripts_from_entry_points(z.read(info.filename).decode("utf-8"))
+                for name, entry_point in scripts.items():
+                    layer.add_bytes(f"{VENV_PATH}/bin/{name}", _console_script(entry_point), 0o755)
+
+
+def add_venv_skeleton(layer: _LayerWriter, env: TargetEnvironment, project_scripts: dict[str, str]) -> None:
+    layer.add_bytes(f"{VENV_PATH}/pyvenv.cfg", f"""home = {os.path.dirname(env.python_executable)}
+include-system-site-packages = false
+version = {env.python_full_version}
+""".encode("utf-8"))
+    layer.add_symlink(f"{VENV_PATH}/bin/python", env.python_executable)
+    layer.add_symlink(f"{VENV_PATH}/bin/python3", "python")
+    layer.add_symlink(f"{VENV_PATH}/bin/python{env.python_version}", "python")
+    for name, entry_point in project_scripts.items():
+        layer.add_bytes(f"{VENV_PATH}/bin/{name}", _console_script(entry_point), 0o755)
+
+
+def _read_project_scripts(real_context_path: str) -> dict[str, str]:
+    with open(os.path.join(real_context_path, "pyproject.toml"), "rb") as f:
+        pyproject = tomllib.load(f)
+    scripts = dict(pyproject.get("project", dict()).get("scripts", dict()))
+    for name, value in pyproject.get("tool", dict()).get("poetry", dict()).get("scripts", dict()).items():
+        if isinstance(value, str):
+            scripts[name] = value
+        elif isinstance(value, dict) and "callable" in value:
+            scripts[name] = value["callable"]
+    return scripts
+
+
+def _layer_cache_path(key: str) -> str:
+    return os.path.join(_cache_dir(), "layers", f"{key}.json")
+
+
+def build_dependency_layer(
+        layer: DependencyLayer,
+        wheels: List[ResolvedWheel],
+        env: TargetEnvironment,
+        project_scripts: dict[str, str],
+        mtime: int
+) -> LayerBlob:
+    """
+    Layers are cached by the hashes of their wheels, so unchanged dependencies are not unpacked again.
+    """
+    key_data = json.dumps({
+        "layer": layer.name,
+        "wheels": sorted(_sha256_file(wheel.path) for wheel in wheels),
+        "python": [env.python_full_version, env.python_executable],
+        "scripts": project_scripts if layer.name == "venv" else {},
+        "mtime": mtime,
+    }, sort_keys=True)
+    cache_path = _layer_cache_path(hashlib.sha256(key_data.encode("utf-8")).hexdigest())
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if os.path.exists(_blob_path(cached["digest"])):
+            blob = LayerBlob()
+            blob.__dict__.update(cached)
+            return blob
+    writer = _LayerWriter(mtime)
+    if layer.name == "venv":
+        add_venv_skeleton(writer, env, project_scripts)
+    for wheel in wheels:
+        add_wheel(writer, wheel.path, env)
+    blob = writer.write(f"dockerpyze: {layer.name} ({len(wheels)} wheels)")
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump(blob.__dict__, f)
+    return blob
+
+
+def build_app_layer(config: ProjectConfiguration, real_context_path: str, mtime: int) -> LayerBlob:
+    writer = _LayerWriter(mtime)
+    for package in _remove_duplicates(config.app_packages):
+        package_path = os.path.join(real_context_path, package)
+        if not os.path.exists(package_path):
+            print(f"WARNING: {package} not found, skipping it")
+            continue
+        paths = [package_path] if os.path.isfile(package_path) else [
+            os.path.join(dirpath, filename)
+            for dirpath, dirnames, filenames in os.walk(package_path)
+            if "__pycache__" not in dirpath.split(os.sep)
+            for filename in filenames if not filename.endswith((".pyc", ".pyo"))
+        ]
+        for path in paths:
+            mode = 0o755 if os.access(path, os.X_OK) else 0o644
+            writer.add_file(f"app/{os.path.relpath(path, real_context_path)}", path, mode)
+    return writer.write("dockerpyze: app")
+
+
+def _group_wheels_by_layer(config: ProjectConfiguration, wheels: List[ResolvedWheel]) -> list[tuple[DependencyLayer, List[ResolvedWheel]]]:
+    layers = [layer for layer in config.dependency_layers if layer.name != "venv"]
+    heavy = {name: layer.name for layer in layers for name in layer.packages}
+    venv_layer = DependencyLayer()
+    venv_layer.name = "venv"
+    venv_layer.packages = {}
+    groups = [(layer, [wheel for wheel in wheels if heavy.get(wheel.name) == layer.name]) for layer in layers]
+    groups.append((venv_layer, [wheel for wheel in wheels if wheel.name not in heavy]))
+    return groups
+
+
+# ---- base image
+
+def parse_image_reference(reference: str) -> tuple[str, str, str]:
+    name, _, digest = reference.partition("@")
+    tag = "latest"
+    if ":" in name.rsplit("/", 1)[-1]:
+        name, tag = name.rsplit(":", 1)
+    first = name.split("/", 1)[0]
+    if "/" in name and ("." in first or ":" in first or first == "localhost"):
+        registry, repository = name.split("/", 1)
+    else:
+        registry, repository = "registry-1.docker.io", name
+        if "/" not in repository:
+            repository = f"library/{repository}"
+    return registry, repository, digest or tag
+
+
+def _select_platform(index: dict, env_architecture: str) -> dict:
+    manifests = index.get("manifests", [])
+    for descriptor in manifests:
+        descriptor_platform = descriptor.get("platform")
+        if descriptor_platform is None:
+            continue
+        if descriptor_platform.get("os") == "linux" and descriptor_platform.get("architecture") == env_architecture:
+            return descriptor
+    unplatformed = [d for d in manifests if "platform" not in d]
+    if unplatformed:
+        return unplatformed[0]
+    raise ValueError(f"Base image has no manifest for linux/{env_architecture}")
+
+
+class _RegistryClient:
+    def __init__(self, registry: str, repository: str):
+        self.registry = registry
+        self.repository = repository
+        self.session = requests.Session()
+
+    def get(self, path: str, accept: Optional[str] = None, stream: bool = False) -> requests.Response:
+        url = f"https://{self.registry}/v2/{self.repository}/{path}"
+        headers = {"Accept": accept} if accept else {}
+        response = self.session.get(url, headers=headers, stream=stream, timeout=60)
+        if response.status_code == 401 and "Authorization" not in self.session.headers:
+            # anonymous token, e.g. for docker hub
+            challenge = dict(re.findall(r'(\w+)="([^"]*)"', response.headers.get("WWW-Authenticate", "")))
+            token_response = requests.get(challenge["realm"], timeout=30, params={
+                "service": challenge.get("service"),
+                "scope": challenge.get("scope", f"repository:{self.repository}:pull"),
+            })
+            token_response.raise_for_status()
+            token = token_response.json().get("token") or token_response.json().get("access_token")
+            self.session.headers["Authorization"] = f"Bearer {token}"
+            response = self.session.get(url, headers=headers, stream=stream, timeout=60)
+        response.raise_for_status()
+        return response
+
+
+def _store_blob(digest: str, write: Callable[[Any], None]) -> None:
+    path = _blob_path(digest)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as tmp:
+        write(tmp)
+    if f"sha256:{_sha256_file(tmp.name)}" != digest:
+        os.remove(tmp.name)
+        raise ValueError(f"Digest mismatch for blob {digest}")
+    os.replace(tmp.name, path)
+
+
+def pull_base_image(reference: str, architecture: str) -> BaseImage:
+    """
+    Manifest and config of the base image, layers are downloaded into the blobs cache with read_blob.
+    The reference can be a registry image or a local OCI layout (oci-layout://<path>).
+    """
+    base_image = BaseImage()
+    if reference.startswith("oci-layout://"):
+        layout_path = reference[len("oci-layout://"):]
+
+        def read_json(digest: str) -> dict:
+            with open(os.path.join(layout_path, "blobs", *digest.split(":", 1))) as f:
+                return json.load(f)
+
+        def read_blob(digest: str, _media_type: str) -> None:
+            _store_blob(digest, lambda tmp: shutil.copyfileobj(
+                open(os.path.join(layout_path, "blobs", *digest.split(":", 1)), "rb"), tmp))
+
+        with open(os.path.join(layout_path, "index.json")) as f:
+            document = json.load(f)
+        while document.get("mediaType", OCI_INDEX) in (OCI_INDEX, DOCKER_MANIFEST_LIST) and "manifests" in document:
+            document = read_json(_select_platform(document, architecture)["digest"])
+        base_image.manifest = document
+        base_image.config = read_json(document["config"]["digest"])
+        base_image.read_blob = read_blob
+        return base_image
+
+    registry, repository, ref = parse_image_reference(reference)
+    client = _RegistryClient(registry, repository)
+    accept = ", ".join([OCI_INDEX, OCI_MANIFEST, DOCKER_MANIFEST_LIST, DOCKER_MANIFEST])
+    document = client.get(f"manifests/{ref}", accept=accept).json()
+    if document.get("mediaType") in (OCI_INDEX, DOCKER_MANIFEST_LIST) or "manifests" in document:
+        descriptor = _select_platform(document, architecture)
+        document = client.get(f"manifests/{descriptor['digest']}", accept=accept).json()
+
+    def read_blob(digest: str, _media_type: str) -> None:
+        def write(tmp) -> None:
+            with client.get(f"blobs/{digest}", stream=True) as response:
+                for chunk in response.iter_content(1024 * 1024):
+                    tmp.write(chunk)
+        _store_blob(digest, write)
+
+    base_image.manifest = document
+    read_blob(document["config"]["digest"], document["config"]["mediaType"])
+    with open(_blob_path(document["config"]["digest"])) as f:
+        base_image.config = json.load(f)
+    base_image.read_blob = read_blob
+    return base_image
+
+
+# ---- image
+
+def _cmd(entrypoint: List[str]) -> List[str]:
+    if len(entrypoint) > 1:
+        return entrypoint
+    return ["/bin/sh", "-c", entrypoint[0]]
+
+
+def generate_image_config(base_config: dict, image: ImageConfiguration, layers: List[LayerBlob], created: str) -> dict:
+    image_config = json.loads(json.dumps(base_config))
+    container_config = image_config.setdefault("config", dict())
+    envs = dict(e.split("=", 1) for e in container_config.get("Env") or [])
+    envs["PATH"] = f"/{VENV_PATH}/bin:{envs.get('PATH', DEFAULT_PATH)}"
+    envs["PYTHONUNBUFFERED"] = "1"
+    envs["PYTHONPATH"] = f"{envs.get('PYTHONPATH', '')}:/app"
+    envs.update(image.envs)
+    container_config["Env"] = [f"{key}={value}" for key, value in envs.items()]
+    # the entrypoint of the base image (e.g. python3 in distroless) would wrap Cmd
+    container_config["Entrypoint"] = None
+    container_config["Cmd"] = _cmd(image.entrypoint)
+    container_config["WorkingDir"] = "/app"
+    container_config["Labels"] = {**(container_config.get("Labels") or {}),
+                                  **{key: str(value) for key, value in image.labels.items()}}
+    if image.ports:
+        container_config["ExposedPorts"] = {**(container_config.get("ExposedPorts") or {}),
+                                            **{f"{port}/tcp": {} for port in image.ports}}
+    image_config["created"] = created
+    image_config.setdefault("rootfs", {"type": "layers", "diff_ids": []})
+    image_config["rootfs"]["diff_ids"] = image_config["rootfs"].get("diff_ids", []) + [layer.diff_id for layer in layers]
+    image_config["history"] = image_config.get("history", []) + [
+        {"created": created, "created_by": layer.created_by} for layer in layers
+    ]
+    return image_config
+
+
+def _write_json_blob(document: dict) -> tuple[str, int]:
+    data = json.dumps(document, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    digest = f"sha256:{hashlib.sha256(data).hexdigest()}"
+    _store_blob(digest, lambda tmp: tmp.write(data))
+    return digest, len(data)
+
+
+def write_oci_layout(output: str, manifest_digest: str, manifest_size: int, blobs: List[str], image: ImageConfiguration) -> None:
+    index = {
+        "schemaVersion": 2,
+        "mediaType": OCI_INDEX,
+        "manifests": [{
+            "mediaType": OCI_MANIFEST,
+            "digest": manifest_digest,
+            "size": manifest_size,
+            "annotations": {
+                "io.containerd.image.name": f"{image.image_name}:{tag}",
+                "org.opencontainers.image.ref.name": tag,
+            },
+        } for tag in image.image_tags],
+    }
+    files = {
+        "oci-layout": json.dumps({"imageLayoutVersion": "1.0.0"}).encode("utf-8"),
+        "index.json": json.dumps(index, indent=2).encode("utf-8"),
+    }
+    blobs = _remove_duplicates(blobs)
+    if output.endswith(".tar"):
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with tarfile.open(output, "w") as tar:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            for digest in blobs:
+                tar.add(_blob_path(digest), arcname=f"blobs/sha256/{digest.split(':', 1)[1]}")
+        return
+    os.makedirs(os.path.join(output, "blobs", "sha256"), exist_ok=True)
+    for name, data in files.items():
+        with open(os.path.join(output, name), "wb") as f:
+            f.write(data)
+    for digest in blobs:
+        shutil.copyfile(_blob_path(digest), os.path.join(output, "blobs", "sha256", digest.split(":", 1)[1]))
+
+
+def build_oci_image(root_path: str, config: ProjectConfiguration, verbose: bool = False) -> str:
+    """
+    Build the image without docker and write it as OCI image layout (tarball if the output ends with .tar).
+    """
+    check_oci_engine_supported(config)
+    real_context_path = os.path.realpath(root_path)
+    image = get_image_targets(config)[0]
+    output = config.oci_output or os.path.join(real_context_path, "dist", f"{image.image_name.replace('/', '-')}.oci.tar")
+    print(f"Building image: {image.image_name}:{image.image_tags[0]} without docker 🔨")
+    start_time = time.time()
+
+    architecture = config.platform.split("/")[1] if config.platform else _host_architecture()
+    base_image = pull_base_image(image.runtime_base_image, architecture)
+    env = get_target_environment(config, image, base_image)
+    wheels = resolve_wheels(config, real_context_path, env)
+    if verbose:
+        for wheel in wheels:
+            print(f"  {wheel.filename}")
+
+    with ThreadPoolExecutor(max_workers=max(config.build_parallelism, 1)) as executor:
+        base_layers = [d for d in base_image.manifest["layers"]]
+        pulls = [executor.submit(base_image.read_blob, d["digest"], d["mediaType"]) for d in base_layers]
+        fetch_wheels(wheels, config.wheel_dir, config.build_parallelism)
+        project_scripts = _read_project_scripts(real_context_path)
+        mtime = get_source_date_epoch(real_context_path) if config.reproducible else 0
+        dependency_layers = list(executor.map(
+            lambda group: build_dependency_layer(group[0], group[1], env, project_scripts, mtime),
+            _group_wheels_by_layer(config, wheels)))
+        app_layer = build_app_layer(config, real_context_path, mtime)
+        for pull in pulls:
+            pull.result()
+
+    layers = dependency_layers + [app_layer]
+    # a build time would change the image digest at every build
+    created = datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc)
+    image_config = generate_image_config(base_image.config, image, layers, created.strftime("%Y-%m-%dT%H:%M:%SZ"))
+    config_digest, config_size = _write_json_blob(image_config)
+    layer_descriptors = [{
+        "mediaType": OCI_LAYER_GZIP if d["mediaType"] == DOCKER_LAYER_GZIP else d["mediaType"],
+        "digest": d["digest"],
+        "size": d["size"],
+    } for d in base_layers] + [{
+        "mediaType": layer.media_type,
+        "digest": layer.digest,
+        "size": layer.size,
+    } for layer in layers]
+    manifest = {
+        "schemaVersion": 2,
+        "mediaType": OCI_MANIFEST,
+        "config": {"mediaType": OCI_CONFIG, "digest": config_digest, "size": config_size},
+        "layers": layer_descriptors,
+    }
+    manifest_digest, manifest_size = _write_json_blob(manifest)
+    write_oci_layout(output, manifest_digest, manifest_size,
+                     [config_digest, manifest_digest] + [d["digest"] for d in layer_descriptors], image)
+    diff = time.time() - start_time
+    print(f"Successfully built image: ✅  ({round(diff, 1)}s)")
+    print(f"  - {output} ({', '.join(f'{image.image_name}:{tag}' for tag in image.image_tags)})")
+    return output
@@ -4,7 +4,8 @@ from cleo.commands.command import Command
 from cleo.helpers import option
 from poetry.plugins.application_plugin import ApplicationPlugin
 
-from dockerize.builder import build_image
+from dockerpyze.builder import build_image
+from dockerpyze.watch import watch
 
 
 class DockerCommand(Command):
@@ -28,13 +29,36 @@ class DockerCommand(Command):
             description="(dockerpyze) Generate and persist Dockerfile",
             flag=True,
         ),
+        option(
+            "no-cache",
+            description="(dockerpyze) Do not use the docker cache",
+            flag=True,
+        ),
+        option(
+            "watch",
+            description="(dockerpyze) Watch the project and rebuild the image on changes",
+            flag=True,
+        ),
+        option(
+            "run",
+            description="(dockerpyze) With --watch, restart a container of the image after every build",
+            flag=True,
+        ),
     ]
 
     def handle(self) -> int:
+        if self.option("watch"):
+            watch(
+                path=self.option("path"),
+                verbose=self.option("debug"),
+                run=self.option("run"),
+            )
+            return 0
         build_image(
             path=self.option("path"),
             verbose=self.option("debug"),
             generate=self.option("generate"),
+            no_cache=self.option("no-cache"),
         )
         return 0
 
@@ -0,0 +1,208 @@
+import io
+import os
+import tarfile
+import time
+import tomllib
+from typing import List, Optional, Literal
+
+import docker
+from docker.errors import APIError, BuildError, NotFound
+
+from dockerpyze.builder import ProjectConfiguration, ImageConfiguration, parse_pyproject_toml, build, \
+    get_image_targets, print_build_logs, _remove_duplicates
+
+DEPENDENCY_FILES = ["pyproject.toml", "poetry.lock", "uv.lock"]
+WATCH_BASE_TAG = "dpy-watch-base"
+
+
+def _is_ignored(name: str) -> bool:
+    return name == "__pycache__" or name.startswith(".") or name.endswith((".pyc", ".pyo"))
+
+
+def _walk_files(real_context_path: str, package: str) -> List[str]:
+    package_path = os.path.join(real_context_path, package)
+    if os.path.isfile(package_path):
+        return [package]
+    files = []
+    for dirpath, dirnames, filenames in os.walk(package_path):
+        dirnames[:] = sorted(d for d in dirnames if not _is_ignored(d))
+        for filename in sorted(filenames):
+            if not _is_ignored(filename):
+                files.append(os.path.relpath(os.path.join(dirpath, filename), real_context_path))
+    return files
+
+
+def snapshot(config: ProjectConfiguration, real_context_path: str) -> dict[str, float]:
+    """
+    Modification time of every watched file, by path relative to the project root.
+    """
+    files = {}
+    watched = DEPENDENCY_FILES + _remove_duplicates(config.deps_packages + config.app_packages)
+    for package in watched:
+        for file in _walk_files(real_context_path, package):
+            try:
+                files[file] = os.path.getmtime(os.path.join(real_context_path, file))
+            except FileNotFoundError:
+                pass
+    return files
+
+
+def classify_changes(
+        config: ProjectConfiguration,
+        before: dict[str, float],
+        after: dict[str, float]
+) -> Optional[Literal["app", "full"]]:
+    """
+    'app' if only application sources changed, 'full' if dependencies changed or files were removed.
+    """
+    changed = [file for file, mtime in after.items() if before.get(file) != mtime]
+    removed = [file for file in before if file not in after]
+    if not changed and not removed:
+        return None
+    # removed files would still be in the base image
+    if removed:
+        return "full"
+    deps_prefixes = tuple(os.path.join(os.path.normpath(package), "") for package in config.deps_packages)
+    for file in changed:
+        if file in DEPENDENCY_FILES or file.startswith(deps_prefixes) or os.path.normpath(file) in config.deps_packages:
+            return "full"
+    return "app"
+
+
+def generate_app_layer_context(config: ProjectConfiguration, image: ImageConfiguration, real_context_path: str) -> io.BytesIO:
+    """
+    Build context with only the application packages, copied on top of the last full build.
+    """
+    dockerfile = f"FROM {image.image_name}:{WATCH_BASE_TAG}\n"
+    context = io.BytesIO()
+    with tarfile.open(fileobj=context, mode="w") as tar:
+        for package in _remove_duplicates(config.app_packages):
+            if not os.path.exists(os.path.join(real_context_path, package)):
+                continue
+            dockerfile += f"COPY ./{package} /app/{package}\n"
+            for file in _walk_files(real_context_path, package):
+                tar.add(os.path.join(real_context_path, file), arcname=file)
+        dockerfile_bytes = dockerfile.encode("utf-8")
+        info = tarfile.TarInfo("Dockerfile")
+        info.size = len(dockerfile_bytes)
+        tar.addfile(info, io.BytesIO(dockerfile_bytes))
+    context.seek(0)
+    return context
+
+
+def build_app_layer(
+        docker_client: docker.DockerClient,
+        config: ProjectConfiguration,
+        real_context_path: str,
+        verbose: bool = False
+) -> None:
+    for image in get_image_targets(config):
+        full_image_name = f"{image.image_name}:{image.image_tags[0]}"
+        print(f"Rebuilding application layer: {full_image_name} 🔨")
+        try:
+            _, decoder = docker_client.images.build(
+                fileobj=generate_app_layer_context(config, image, real_context_path),
+                custom_context=True,
+                tag=full_image_name,
+                platform=config.platform or None,
+            )
+            if verbose:
+                print_build_logs(decoder)
+        except BuildError as e:
+            print("❌ Build failed, printing execution logs:\n\n")
+            print_build_logs(iter(e.build_log))
+            raise e
+        for tag in image.image_tags[1:]:
+            docker_client.images.get(full_image_name).tag(image.image_name, tag=tag)
+
+
+def build_full(
+        docker_client: docker.DockerClient,
+        config: ProjectConfiguration,
+        real_context_path: str,
+        verbose: bool = False
+) -> None:
+    if config.engine != "docker":
+        # the application layer is rebuilt on top of the image loaded in the docker daemon
+        raise ValueError(f"watch requires engine = \"docker\", engine = \"{config.engine}\" doesn't load the image in docker")
+    build(root_path=real_context_path, config=config, verbose=verbose)
+    for image in get_image_targets(config):
+        docker_client.images.get(f"{image.image_name}:{image.image_tags[0]}").tag(image.image_name, tag=WATCH_BASE_TAG)
+
+
+def restart_container(docker_client: docker.DockerClient, image: ImageConfiguration, timeout: float = 30) -> None:
+    container_name = f"{image.image_name.replace('/', '-')}-dpy-watch"
+    try:
+        docker_client.containers.get(container_name).remove(force=True)
+    except NotFound:
+        pass
+    container = docker_client.containers.run(
+        f"{image.image_name}:{image.image_tags[0]}",
+        name=container_name,
+        detach=True,
+        ports={f"{port}/tcp": port for port in image.ports},
+    )
+    deadline = time.time() + timeout
+    while container.status != "running" and time.time() < deadline:
+        time.sleep(0.1)
+        container.reload()
+    if container.status != "running":
+        print(f"⚠️ Container {container_name} is {container.status}, check `docker logs {container_name}`")
+
+
+def watch(
+        path: str,
+        verbose: bool = False,
+        run: bool = False,
+        interval: float = 0.5,
+        debounce: float = 0.5
+) -> None:
+    """
+    Rebuild the image when the project changes. Only the application layer is rebuilt if
+    dependencies didn't change. With run, the first image is restarted after every build.
+    """
+    real_context_path = os.path.realpath(path)
+    docker_client = docker.from_env()
+    config = parse_pyproject_toml(real_context_path)
+    build_full(docker_client, config, real_context_path, verbose=verbose)
+    if run:
+        restart_container(docker_client, get_image_targets(config)[0])
+    built = seen = snapshot(config, real_context_path)
+    print(f"Watching for changes in {real_context_path} 👀 (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(interval)
+            current = snapshot(config, real_context_path)
+            if current == seen:
+                continue
+            change_time = time.time()
+            # wait for the editor to finish writing
+            while True:
+                time.sleep(debounce)
+                latest = snapshot(config, real_context_path)
+                if latest == current:
+                    break
+                current = latest
+            seen = current
+            # compared with the last successful build, so that a failed build is retried with the next change
+            change = classify_changes(config, built, current)
+            if change is None:
+                continue
+            try:
+                if change == "full":
+                    print("Dependencies changed, rebuilding the whole image")
+                    config = parse_pyproject_toml(real_context_path)
+                    build_full(docker_client, config, real_context_path, verbose=verbose)
+                else:
+                    build_app_layer(docker_client, config, real_context_path, verbose=verbose)
+                if run:
+                    restart_container(docker_client, get_image_targets(config)[0])
+                print(f"Ready: ✅  ({round(time.time() - change_time, 1)}s from change)")
+                built = current
+            except BuildError:
+                print("Waiting for changes to fix the build")
+            except (tomllib.TOMLDecodeError, ValueError, APIError) as e:
+                # e.g. pyproject.toml saved while being edited
+                print(f"❌ {e}\nWaiting for changes to fix the build")
+    except KeyboardInterrupt:
+        print("Stopped watching")
@@ -1,8 +1,12 @@
+import json
 import os
+import subprocess
+import tarfile
 import tempfile
 
-from dockerpyze.builder import build_image, parse_pyproject_toml, generate_docker_file_content, \
-    ProjectConfiguration
+from dockerpyze import builder as builder_module
+from dockerpyze.builder import build_image, parse_pyproject_toml, generate_docker_file_content, generate_buildx_output_str, \
+    generate_build_args, generate_container_limits, generate_split_layers_str, ProjectConfiguration, SPLIT_LAYERS_SCRIPT
 
 dirname = os.path.dirname(__file__)
 test_project = os.path.join(dirname, 'test_project')
@@ -16,6 +20,15 @@ def _parse_pyproject_toml_content(content: str) -> ProjectConfiguration:
     return parse_pyproject_toml(tempdir.name)
 
 
+def _parse_pyproject_toml_content_with_lock(content: str, lock_file: str, lock_content: str) -> ProjectConfiguration:
+    tempdir = tempfile.TemporaryDirectory()
+    with open(os.path.join(tempdir.name, lock_file), 'w') as f:
+        f.write(lock_content)
+    with open(os.path.join(tempdir.name, "pyproject.toml"), 'w') as f:
+        f.write(content)
+    return parse_pyproject_toml(tempdir.name)
+
+
 def test() -> None:
     clean_dockerfile()
     build_image(path=test_project)
@@ -203,6 +216,10 @@ COPY ./app /app/app
 
 RUN poetry -V
 
+ARG BUILD_PARALLELISM=1
+ENV MAKEFLAGS="-j${BUILD_PARALLELISM}"
+ENV CMAKE_BUILD_PARALLEL_LEVEL=${BUILD_PARALLELISM}
+ENV POETRY_INSTALLER_MAX_WORKERS=${BUILD_PARALLELISM}
 RUN cd /app && poetry install --no-interaction --no-ansi -E ext
 
 FROM python:3.11-slim-bookworm AS runtime
@@ -226,6 +243,7 @@ ENV PORT=5001
 
 WORKDIR /app
 COPY --from=builder /app/ /app/
+ENV PYTHONPATH="${PYTHONPATH}:/app"
 
 EXPOSE 5001
 RUN echo 'Hello from Dockerfile' > /tmp/hello.txt
@@ -256,3 +274,512 @@ def test_parse_from_env() -> None:
         os.environ.pop("DPY_PORTS")
         os.environ.pop("DPY_ENV_VAR1")
         os.environ.pop("DPY_ENV_VAR2")
+
+
+def test_parse_images() -> None:
+    doc = _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    ports = [8000]
+    env = {APP_ENV = "prod"}
+    apt-packages = ["curl"]
+    [tool.dpy.images.api]
+    entrypoint = ["uvicorn", "app.main:app"]
+    [tool.dpy.images.worker]
+    name = "my-worker"
+    tags = ["dev"]
+    entrypoint = ["python", "-m", "app.worker"]
+    ports = []
+    apt-packages = []
+    env = {QUEUE = "default"}
+        """)
+    assert doc.entrypoint == []
+    api, worker = doc.images
+    assert api.target == "api"
+    assert api.image_name == "my-app-api"
+    assert api.image_tags == ["0.1.0", "latest"]
+    assert api.ports == [8000]
+    assert api.labels["org.opencontainers.image.title"] == "my-app-api"
+    assert worker.image_name == "my-worker"
+    assert worker.image_tags == ["dev"]
+    assert worker.ports == []
+    assert worker.envs == {"APP_ENV": "prod", "QUEUE": "default"}
+    assert api.runtime_apt_packages == ["curl"]
+    assert worker.runtime_apt_packages == []
+
+
+def test_parse_images_without_entrypoint() -> None:
+    try:
+        _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy.images.api]
+    ports = [8000]
+        """)
+        assert False
+    except ValueError as e:
+        assert str(e) == "No entrypoint specified for image 'api', please specify 'entrypoint' in 'tool.dpy.images.api' section"
+
+
+def test_generate_images() -> None:
+    doc = _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy.images.api]
+    entrypoint = ["uvicorn", "app.main:app"]
+    ports = [8000]
+    [tool.dpy.images.cron]
+    entrypoint = ["python", "-m", "app.cron"]
+        """)
+    content = generate_docker_file_content(doc, dummy_project)
+    assert content.count("AS builder") == 1
+    assert content.count("RUN cd /app && uv sync") == 1
+    assert "FROM python:3.11-slim-bookworm AS api" in content
+    assert "FROM python:3.11-slim-bookworm AS cron" in content
+    assert content.index("AS api") < content.index("EXPOSE 8000") < content.index("AS cron")
+    assert 'CMD ["python", "-m", "app.cron"]' in content
+
+
+def test_build_images_no_cache(monkeypatch) -> None:
+    doc = _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy.images.api]
+    entrypoint = ["uvicorn", "app.main:app"]
+    [tool.dpy.images.cron]
+    entrypoint = ["python", "-m", "app.cron"]
+        """)
+    builds = []
+    monkeypatch.setattr(builder_module.docker, "from_env", lambda: None)
+    monkeypatch.setattr(builder_module, "build_image_target",
+                        lambda *args, **kwargs: builds.append((args[4].target, kwargs["no_cache"])))
+    with tempfile.TemporaryDirectory() as root:
+        builder_module.build(root_path=root, config=doc, no_cache=True)
+    # the dependencies are installed once, cron reuses the builder stage of api
+    assert builds == [("api", True), ("cron", False)]
+
+
+def test_runtime_base_image() -> None:
+    doc = _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    requires-python = "^3.12"
+    [tool.dpy]
+    entrypoint = ["python", "-m", "app"]
+    runtime-base-image = "python:3.12-slim"
+        """)
+    assert doc.base_image == "python:3.12-slim-bookworm"
+    assert doc.runtime_base_image == "python:3.12-slim"
+    content = generate_docker_file_content(doc, dummy_project)
+    assert "FROM python:3.12-slim-bookworm AS builder" in content
+    assert "FROM python:3.12-slim AS runtime" in content
+    assert "ENTRYPOINT []" in content
+
+
+def _assert_runtime_base_image_error(dpy_section: str, expected: str) -> None:
+    doc = _parse_pyproject_toml_content(f"""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    {dpy_section}
+        """)
+    try:
+        generate_docker_file_content(doc, dummy_project)
+        assert False
+    except ValueError as e:
+        assert str(e) == expected
+
+
+def test_runtime_base_image_incompatible() -> None:
+    _assert_runtime_base_image_error("""
+    entrypoint = ["python", "-m", "app"]
+    runtime-base-image = "python:3.12-slim"
+    """, "Runtime base image python:3.12-slim has python 3.12 while builder base image python:3.11-slim-bookworm has python 3.11")
+    _assert_runtime_base_image_error("""
+    entrypoint = ["python", "-m", "app"]
+    runtime-base-image = "python:3.11-alpine"
+    """, "Runtime base image python:3.11-alpine uses musl while builder base image python:3.11-slim-bookworm uses glibc")
+    _assert_runtime_base_image_error("""
+    entrypoint = ["python", "-m", "app"]
+    runtime-base-image = "gcr.io/distroless/python3-debian12"
+    """, "The virtualenv interpreter /usr/local/bin/python3.11 of builder base image python:3.11-slim-bookworm "
+         "is not available in runtime base image gcr.io/distroless/python3-debian12 (found /usr/bin/python3.11), "
+         "the virtualenv wouldn't run. Please use a builder base image with the python interpreter at /usr/bin/python3.11")
+
+
+def test_runtime_base_image_builder_pairing() -> None:
+    doc = _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    entrypoint = ["python", "-m", "app"]
+    base-image = "python:3.11-bookworm"
+    runtime-base-image = "python:3.11-slim-bookworm"
+        """)
+    content = generate_docker_file_content(doc, dummy_project)
+    assert "FROM python:3.11-bookworm AS builder" in content
+    assert "FROM python:3.11-slim-bookworm AS runtime" in content
+    _assert_runtime_base_image_error("""
+    entrypoint = ["python", "-m", "app"]
+    base-image = "gcr.io/distroless/python3-debian12"
+    """, "Base image gcr.io/distroless/python3-debian12 can't be used for the builder stage, it has no shell. "
+         "Please use a python image as 'base-image' and set the smaller image as 'runtime-base-image'")
+    _assert_runtime_base_image_error("""
+    entrypoint = ["python", "-m", "app"]
+    base-image = "cgr.dev/chainguard/python:latest-dev"
+    """, "Base image cgr.dev/chainguard/python:latest-dev can't be used for the builder stage, it has no apt package manager. "
+         "Please use a python image as 'base-image' and set the smaller image as 'runtime-base-image'")
+
+
+def test_runtime_base_image_without_package_manager() -> None:
+    # custom builder with the debian python interpreter, only the runtime base image is checked
+    _assert_runtime_base_image_error("""
+    entrypoint = ["python", "-m", "app"]
+    base-image = "registry.example.com/debian12-python-builder"
+    runtime-base-image = "gcr.io/distroless/python3-debian12"
+    apt-packages = ["curl"]
+    """, "Runtime base image gcr.io/distroless/python3-debian12 has no apt package manager, 'apt-packages' can't be installed: curl")
+    _assert_runtime_base_image_error("""
+    entrypoint = "python -m app"
+    base-image = "registry.example.com/debian12-python-builder"
+    runtime-base-image = "gcr.io/distroless/python3-debian12"
+    """, "Runtime base image gcr.io/distroless/python3-debian12 has no shell, please specify 'entrypoint' as a list (exec format)")
+    doc = _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    entrypoint = ["python", "-m", "app"]
+    base-image = "registry.example.com/debian12-python-builder"
+    runtime-base-image = "gcr.io/distroless/python3-debian12"
+        """)
+    content = generate_docker_file_content(doc, dummy_project)
+    # distroless runs python3 as entrypoint, it is cleared so that CMD is the whole command
+    assert content.endswith('ENTRYPOINT []\nCMD ["python", "-m", "app"]')
+
+
+def test_generate_reproducible() -> None:
+    doc = _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    entrypoint = ["python", "-m", "app"]
+    apt-packages = ["curl"]
+    reproducible = true
+        """)
+    assert doc.reproducible
+    content = generate_docker_file_content(doc, dummy_project)
+    assert "dist-upgrade" not in content
+    assert "ARG SOURCE_DATE_EPOCH=0\nENV SOURCE_DATE_EPOCH=${SOURCE_DATE_EPOCH}" in content
+    assert "&& apt-get update      && apt-get -y install curl      && rm -rf /var/lib/apt/lists/*" in content
+    assert "RUN find /app -exec touch --no-dereference --date=@${SOURCE_DATE_EPOCH} {} +" in content
+    assert "COPY --from=builder /app/ /app/\nWORKDIR /app" in content
+
+
+def test_reproducible_build() -> None:
+    import docker
+    docker_client = docker.from_env()
+    try:
+        os.environ["DPY_REPRODUCIBLE"] = "true"
+        os.environ["DPY_TAGS"] = "reproducible"
+        layers = []
+        for _ in range(2):
+            build_image(path=dummy_project, no_cache=True)
+            layers.append(docker_client.images.get("my-app:reproducible").attrs["RootFS"]["Layers"])
+        assert layers[0] == layers[1]
+    finally:
+        os.environ.pop("DPY_REPRODUCIBLE")
+        os.environ.pop("DPY_TAGS")
+
+
+def test_parse_compression() -> None:
+    doc = _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    entrypoint = ["python", "-m", "app"]
+    compression = "zstd"
+    compression-level = 3
+        """)
+    assert doc.compression == "zstd"
+    assert doc.compression_level == 3
+    assert generate_buildx_output_str(doc) == "type=docker,compression=zstd,force-compression=true,compression-level=3,oci-mediatypes=true"
+    try:
+        _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    entrypoint = ["python", "-m", "app"]
+    compression = "lz4"
+        """)
+        assert False
+    except ValueError as e:
+        assert str(e) == "Invalid compression 'lz4', expected one of: gzip, zstd, estargz"
+
+
+def test_buildx_required_for_compression(monkeypatch) -> None:
+    def run(cmd, **kwargs):
+        raise FileNotFoundError(cmd[0])
+
+    monkeypatch.setattr(builder_module.subprocess, "run", run)
+    try:
+        builder_module.check_buildx_available()
+        assert False
+    except ValueError as e:
+        assert str(e) == "'compression' requires docker buildx, the docker command was not found"
+    monkeypatch.setattr(builder_module.subprocess, "run",
+                        lambda cmd, **kwargs: subprocess.CompletedProcess(cmd, 1, "", "'buildx' is not a docker command"))
+    try:
+        builder_module.check_buildx_available()
+        assert False
+    except ValueError as e:
+        assert str(e) == "'compression' requires docker buildx, please install the docker buildx plugin"
+
+
+def test_parse_build_parallelism() -> None:
+    doc = _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    entrypoint = ["python", "-m", "app"]
+        """)
+    assert doc.build_parallelism == len(os.sched_getaffinity(0))
+    assert generate_container_limits(doc) == {}
+    doc = _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    entrypoint = ["python", "-m", "app"]
+    build-parallelism = 8
+    build-memory = "4g"
+    build-cpuset-cpus = "0-7"
+        """)
+    assert generate_build_args(doc, dummy_project) == {"BUILD_PARALLELISM": "8"}
+    assert generate_container_limits(doc) == {"memory": 4 * 1024 ** 3, "cpusetcpus": "0-7"}
+    content = generate_docker_file_content(doc, dummy_project)
+    assert "ENV UV_CONCURRENT_DOWNLOADS=${BUILD_PARALLELISM}\nENV UV_CONCURRENT_BUILDS=${BUILD_PARALLELISM}" in content
+    doc = _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    entrypoint = ["python", "-m", "app"]
+    build-cpuset-cpus = "0-7,16,18-19"
+        """)
+    # defaults to the CPUs of the build containers
+    assert doc.build_parallelism == 11
+    try:
+        _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    entrypoint = ["python", "-m", "app"]
+    build-parallelism = 0
+        """)
+        assert False
+    except ValueError as e:
+        assert str(e) == "Invalid build-parallelism '0', expected at least 1"
+    try:
+        _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    entrypoint = ["python", "-m", "app"]
+    build-cpuset-cpus = "7-0"
+        """)
+        assert False
+    except ValueError as e:
+        assert str(e) == "Invalid cpuset '7-0', expected a list of CPUs or ranges, e.g. 0-7,16"
+    try:
+        _parse_pyproject_toml_content("""
+    [project]
+    name = "my-app"
+    version = "0.1.0"
+    [tool.dpy]
+    entrypoint = ["python", "-m", "app"]
+    compression = "zstd"
+    build-memory = "4g"
+        """)
+        assert False
+    except ValueError as e:
+        assert str(e) == "'build-memory' and 'build-cpuset-cpus' are not supported with 'compression'"
+
+
+_split_pyproject = """
+[project]
+name = "my-app"
+version = "0.1.0"
+[tool.dpy]
+entrypoint = ["python", "-m", "app"]
+layer-strategy = "split"
+heavy-packages = ["big-lib"]
+reproducible = true
+"""
+
+
+def _uv_lock(idna_version: str) -> str:
+    return f"""
+version = 1
+
+[[package]]
+name = "my-app"
+version = "0.1.0"
+source = {{ editable = "." }}
+
+[[package]]
+name = "Big_Lib"
+version = "1.0.0"
+source = {{ registry = "https://pypi.org/simple" }}
+wheels = [{{ url = "https://example.com/big_lib-1.0.0-py3-none-any.whl", size = 1000 }}]
+
+[[package]]
+name = "idna"
+version = "{idna_version}"
+source = {{ registry = "https://pypi.org/simple" }}
+wheels = [{{ url = "https://example.com/idna-{idna_version}-py3-none-any.whl", size = 70000 }}]
+
+[[package]]
+name = "numpy"
+version = "2.0.0"
+source = {{ registry = "https://pypi.org/simple" }}
+
+[[package]]
+name = "onnx"
+version = "1.16.0"
+source = {{ registry = "https://pypi.org/simple" }}
+wheels = [{{ url = "https://example.com/onnx-1.16.0-cp311-cp311-manylinux_2_17_x86_64.whl", size = 60000000 }}]
+"""
+
+
+def test_dependency_layers() -> None:
+    doc = _parse_pyproject_toml_content_with_lock(_split_pyproject, "uv.lock", _uv_lock("3.6"))
+    assert [(layer.name, layer.packages) for layer in doc.dependency_layers] == [
+        ("deps-big-lib", {"big-lib": "1.0.0"}),
+        ("deps-numpy", {"numpy": "2.0.0"}),
+        ("deps-onnx", {"onnx": "1.16.0"}),
+        ("venv", {"idna": "3.6"}),
+    ]
+    content = generate_docker_file_content(doc, dummy_project)
+    assert "/app/.venv/bin/python /tmp/split_layers.py deps-big-lib=big-lib deps-numpy=numpy deps-onnx=onnx " in content
+    assert ("RUN find /layers -exec touch --no-dereference --date=@0 {} + "
+            "&& find /app -exec touch --no-dereference --date=@${SOURCE_DATE_EPOCH} {} +") in content
+    assert """COPY --from=builder /layers/deps-big-lib/ /
+COPY --from=builder /layers/deps-numpy/ /
+COPY --from=builder /layers/deps-onnx/ /
+COPY --from=builder /layers/venv/ /
+COPY --from=builder /app/ /app/
+WORKDIR /app
+""" in content
+
+
+def test_dependency_layers_small_bump() -> None:
+    doc = _parse_pyproject_toml_content_with_lock(_split_pyproject, "uv.lock", _uv_lock("3.6"))
+    bumped_doc = _parse_pyproject_toml_content_with_lock(_split_pyproject, "uv.lock", _uv_lock("3.7"))
+    layers = [(layer.name, layer.packages) for layer in doc.dependency_layers]
+    bumped_layers = [(layer.name, layer.packages) for layer in bumped_doc.dependency_layers]
+    assert len(layers) == len(bumped_layers)
+    changed = [layer for layer, bumped_layer in zip(layers, bumped_layers) if layer != bumped_layer]
+    assert changed == [("venv", {"idna": "3.6"})]
+    assert generate_docker_file_content(doc, dummy_project) == generate_docker_file_content(bumped_doc, dummy_project)
+
+
+def test_split_layers_script() -> None:
+    doc = _parse_pyproject_toml_content_with_lock(_split_pyproject, "uv.lock", _uv_lock("3.6"))
+    run_str = generate_split_layers_str(doc)
+    # the RUN instruction writes the script with printf, run that part with sh
+    write_script = run_str.removeprefix("RUN ").split(" > /tmp/split_layers.py")[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        script_path = os.path.join(tmp, "split_layers.py")
+        subprocess.run(["sh", "-c", f"{write_script} > {script_path}"], check=True)
+        with open(script_path) as f:
+            assert f.read() == SPLIT_LAYERS_SCRIPT.lstrip("\n")
+
+
+def _diff_ids_of_layers_with(docker_client, image_name: str, paths: list[str]) -> list[str]:
+    """
+    diff_id of the image layer containing each path.
+    """
+    with tempfile.TemporaryFile() as tmp:
+        for chunk in docker_client.images.get(image_name).save():
+            tmp.write(chunk)
+        tmp.seek(0)
+        with tarfile.open(fileobj=tmp) as image_tar:
+            manifest = json.load(image_tar.extractfile("manifest.json"))
+            diff_ids = json.load(image_tar.extractfile(manifest[0]["Config"]))["rootfs"]["diff_ids"]
+            layers_names = []
+            for layer in manifest[0]["Layers"]:
+                with tarfile.open(fileobj=image_tar.extractfile(layer)) as layer_tar:
+                    layers_names.append(set(layer_tar.getnames()))
+    return [next(diff_id for diff_id, names in zip(diff_ids, layers_names) if any(path in name for name in names))
+            for path in paths]
+
+
+def _write_split_project(root: str, idna_version: str) -> None:
+    with open(os.path.join(root, "pyproject.toml"), "w") as f:
+        f.write(f"""[tool.poetry]
+name = "split-app"
+version = "0.1.0"
+packages = [{{include = "app"}}]
+authors = ["Split Author"]
+
+[tool.poetry.dependencies]
+python = "^3.11"
+six = "1.16.0"
+idna = "{idna_version}"
+
+[tool.dpy]
+entrypoint = ["python", "-m", "app"]
+tags = ["split"]
+reproducible = true
+layer-strategy = "split"
+heavy-packages = ["six"]
+""")
+    # only read to assign the layers, the lock file is ignored by the build and poetry resolves the pinned versions
+    with open(os.path.join(root, "poetry.lock"), "w") as f:
+        f.write(f"""# This file is automatically @generated by Poetry 1.8.3 and should not be changed by hand.
+
+[[package]]
+name = "idna"
+version = "{idna_version}"
+
+[[package]]
+name = "six"
+version = "1.16.0"
+""")
+
+
+def test_split_layers_build(monkeypatch) -> None:
+    import docker
+    docker_client = docker.from_env()
+    builds = []
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(os.path.join(root, "app"))
+        with open(os.path.join(root, "app", "__init__.py"), "w") as f:
+            f.write("print('split')\n")
+        with open(os.path.join(root, ".dockerignore"), "w") as f:
+            f.write("poetry.lock\n")
+        # a small dependency bump in a later commit
+        for idna_version, source_date_epoch in [("3.6", 1700000000), ("3.7", 1710000000)]:
+            _write_split_project(root, idna_version)
+            monkeypatch.setattr(builder_module, "get_source_date_epoch", lambda path: source_date_epoch)
+            build_image(path=root, no_cache=True)
+            # the six layer and the rest of the virtualenv
+            builds.append(_diff_ids_of_layers_with(docker_client, "split-app:split",
+                                                   ["site-packages/six.py", "app/.venv/pyvenv.cfg"]))
+    assert builds[0][0] == builds[1][0]
+    assert builds[0][1] != builds[1][1]
@@ -0,0 +1,254 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import tarfile
+import tempfile
+import zipfile
+
+from dockerpyze.builder import parse_pyproject_toml, ProjectConfiguration
+from dockerpyze.oci import build_oci_image, check_oci_engine_supported, select_wheel, resolve_poetry_lock, \
+    TargetEnvironment
+from dockerpyze.watch import build_full
+
+
+def _env() -> TargetEnvironment:
+    env = TargetEnvironment()
+    env.python_version = "3.11"
+    env.python_full_version = "3.11.7"
+    env.python_executable = "/usr/local/bin/python3.11"
+    env.architecture = "amd64"
+    env.machine = "x86_64"
+    return env
+
+
+def _write_blob(layout: str, data: bytes) -> dict:
+    digest = hashlib.sha256(data).hexdigest()
+    os.makedirs(os.path.join(layout, "blobs", "sha256"), exist_ok=True)
+    with open(os.path.join(layout, "blobs", "sha256", digest), "wb") as f:
+        f.write(data)
+    return {"digest": f"sha256:{digest}", "size": len(data)}
+
+
+def _write_base_layout(layout: str) -> None:
+    layer = io.BytesIO()
+    with tarfile.open(fileobj=layer, mode="w") as tar:
+        info = tarfile.TarInfo("etc/os-release")
+        info.size = 4
+        tar.addfile(info, io.BytesIO(b"test"))
+    layer_data = gzip.compress(layer.getvalue())
+    config = json.dumps({
+        "architecture": "amd64",
+        "os": "linux",
+        "config": {"Env": ["PATH=/usr/local/bin:/usr/bin:/bin", "PYTHON_VERSION=3.11.7"],
+                   "Entrypoint": ["/usr/local/bin/python3.11"]},
+        "rootfs": {"type": "layers", "diff_ids": [f"sha256:{hashlib.sha256(layer.getvalue()).hexdigest()}"]},
+        "history": [{"created_by": "base"}],
+    }).encode("utf-8")
+    manifest = json.dumps({
+        "schemaVersion": 2,
+        "mediaType": "application/vnd.oci.image.manifest.v1+json",
+        "config": {"mediaType": "application/vnd.oci.image.config.v1+json", **_write_blob(layout, config)},
+        "layers": [{"mediaType": "application/vnd.oci.image.layer.v1.tar+gzip", **_write_blob(layout, layer_data)}],
+    }).encode("utf-8")
+    with open(os.path.join(layout, "index.json"), "w") as f:
+        json.dump({"schemaVersion": 2, "manifests": [{
+            "mediaType": "application/vnd.oci.image.manifest.v1+json", **_write_blob(layout, manifest)}]}, f)
+
+
+def _write_wheel(path: str) -> str:
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("tinylib/__init__.py", "def main():\n    print('tiny')\n")
+        z.writestr("tinylib-1.0.dist-info/METADATA", "Metadata-Version: 2.1\nName: tinylib\nVersion: 1.0\n")
+        z.writestr("tinylib-1.0.dist-info/entry_points.txt", "[console_scripts]\ntiny = tinylib:main\n")
+        z.writestr("tinylib-1.0.data/scripts/tiny-tool", "#!python\nprint('tool')\n")
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _read_layout_blob(layout: str, digest: str) -> bytes:
+    with open(os.path.join(layout, "blobs", *digest.split(":", 1)), "rb") as f:
+        return f.read()
+
+
+def test_select_wheel() -> None:
+    env = _env()
+    wheels = [
+        "numpy-2.0.0-cp311-cp311-manylinux_2_17_x86_64.manylinux2014_x86_64.whl",
+        "numpy-2.0.0-cp311-cp311-manylinux_2_17_aarch64.whl",
+        "numpy-2.0.0-cp312-cp312-manylinux_2_17_x86_64.whl",
+        "numpy-2.0.0-cp311-cp311-musllinux_1_1_x86_64.whl",
+        "numpy-2.0.0-cp311-cp311-win_amd64.whl",
+    ]
+    assert select_wheel(wheels, env) == wheels[0]
+    assert select_wheel(["cryptography-42.0.0-cp39-abi3-manylinux_2_28_x86_64.whl"], env) is not None
+    assert select_wheel(["six-1.16.0-py2.py3-none-any.whl"], env) == "six-1.16.0-py2.py3-none-any.whl"
+    assert select_wheel(["pkg-1.0-cp311-cp311-manylinux_2_39_x86_64.whl"], env) is None
+    assert select_wheel(["pkg-1.0.tar.gz"], env) is None
+
+
+def test_resolve_poetry_lock() -> None:
+    lock = {
+        "package": [
+            {"name": "requests", "version": "2.31.0", "optional": False,
+             "dependencies": {"idna": ">=2.5,<4", "pysocks": {"version": "!=1.5.7", "optional": True}},
+             "extras": {"socks": ["PySocks (>=1.5.6,!=1.5.7)"]},
+             "files": [{"file": "requests-2.31.0-py3-none-any.whl", "hash": "sha256:aa"}]},
+            {"name": "idna", "version": "3.6", "optional": False,
+             "files": [{"file": "idna-3.6-py3-none-any.whl", "hash": "sha256:bb"}]},
+            {"name": "pysocks", "version": "1.7.1", "optional": True,
+             "files": [{"file": "PySocks-1.7.1-py3-none-any.whl", "hash": "sha256:cc"}]},
+            {"name": "pywin32", "version": "306", "optional": False,
+             "files": [{"file": "pywin32-306-cp311-cp311-win_amd64.whl", "hash": "sha256:dd"}]},
+            {"name": "pytest", "version": "8.0.0", "optional": False,
+             "files": [{"file": "pytest-8.0.0-py3-none-any.whl", "hash": "sha256:ee"}]},
+        ],
+    }
+    pyproject = {"tool": {"poetry": {
+        "dependencies": {"python": "^3.11", "requests": {"version": "^2.31", "extras": ["socks"]},
+                         "pywin32": {"version": "306", "markers": "sys_platform == 'win32'"}},
+        "group": {"dev": {"dependencies": {"pytest": "^8"}}},
+    }}}
+    wheels = resolve_poetry_lock(lock, pyproject, ["--without", "dev"], _env())
+    assert [(w.name, w.filename, w.sha256) for w in wheels] == [
+        ("idna", "idna-3.6-py3-none-any.whl", "bb"),
+        ("pysocks", "PySocks-1.7.1-py3-none-any.whl", "cc"),
+        ("requests", "requests-2.31.0-py3-none-any.whl", "aa"),
+    ]
+    wheels = resolve_poetry_lock(lock, pyproject, [], _env())
+    assert "pytest" in [w.name for w in wheels]
+    lock["package"][1]["source"] = {"type": "legacy", "url": "https://download.pytorch.org/whl/cu121",
+                                    "reference": "pytorch"}
+    try:
+        resolve_poetry_lock(lock, pyproject, [], _env())
+        assert False
+    except ValueError as e:
+        assert str(e) == ("Package idna is installed from source 'pytorch' (https://download.pytorch.org/whl/cu121), "
+                          "only PyPI is supported, please use engine = \"docker\"")
+
+
+def test_build_oci_image(monkeypatch) -> None:
+    with tempfile.TemporaryDirectory() as root:
+        monkeypatch.setenv("XDG_CACHE_HOME", os.path.join(root, "cache"))
+        base_layout = os.path.join(root, "base")
+        _write_base_layout(base_layout)
+        project = os.path.join(root, "project")
+        os.makedirs(os.path.join(project, "wheels"))
+        os.makedirs(os.path.join(project, "my_app"))
+        with open(os.path.join(project, "my_app", "__init__.py"), "w") as f:
+            f.write("print('hello')\n")
+        sha256 = _write_wheel(os.path.join(project, "wheels", "tinylib-1.0-py3-none-any.whl"))
+        with open(os.path.join(project, "pyproject.toml"), "w") as f:
+            f.write(f"""[project]
+name = "my-app"
+version = "0.1.0"
+dependencies = ["tinylib"]
+
+[project.scripts]
+my-app = "my_app.cli:main"
+
+[tool.dpy]
+engine = "oci"
+base-image = "oci-layout://{base_layout}"
+wheel-dir = "wheels"
+oci-output = "dist/image"
+entrypoint = ["python", "-m", "my_app"]
+ports = [8000]
+env = {{MODE = "prod"}}
+labels = {{team = "core"}}
+platform = "linux/amd64"
+""")
+        with open(os.path.join(project, "uv.lock"), "w") as f:
+            f.write(f"""version = 1
+
+[[package]]
+name = "my-app"
+version = "0.1.0"
+source = {{ virtual = "." }}
+dependencies = [
+    {{ name = "tinylib" }},
+    {{ name = "winlib", marker = "sys_platform == 'win32'" }},
+]
+
+[[package]]
+name = "tinylib"
+version = "1.0"
+source = {{ registry = "https://pypi.org/simple" }}
+wheels = [
+    {{ url = "https://files.example.com/tinylib-1.0-py3-none-any.whl", hash = "sha256:{sha256}" }},
+]
+
+[[package]]
+name = "winlib"
+version = "1.0"
+source = {{ registry = "https://pypi.org/simple" }}
+wheels = [
+    {{ url = "https://files.example.com/winlib-1.0-cp311-cp311-win_amd64.whl", hash = "sha256:00" }},
+]
+""")
+        config = parse_pyproject_toml(project)
+        output = build_oci_image(project, config)
+        assert output == os.path.join(project, "dist", "image")
+
+        with open(os.path.join(output, "index.json")) as f:
+            index = json.load(f)
+        assert [m["annotations"]["org.opencontainers.image.ref.name"] for m in index["manifests"]] == ["0.1.0", "latest"]
+        manifest = json.loads(_read_layout_blob(output, index["manifests"][0]["digest"]))
+        assert len(manifest["layers"]) == 3
+        image_config = json.loads(_read_layout_blob(output, manifest["config"]["digest"]))
+        container_config = image_config["config"]
+        assert container_config["Entrypoint"] is None
+        assert container_config["Cmd"] == ["python", "-m", "my_app"]
+        assert container_config["WorkingDir"] == "/app"
+        assert container_config["ExposedPorts"] == {"8000/tcp": {}}
+        assert container_config["Labels"]["team"] == "core"
+        assert "PATH=/app/.venv/bin:/usr/local/bin:/usr/bin:/bin" in container_config["Env"]
+        assert "MODE=prod" in container_config["Env"]
+        assert len(image_config["rootfs"]["diff_ids"]) == len(image_config["history"]) == 3
+        assert image_config["created"] == "1970-01-01T00:00:00Z"
+
+        with tarfile.open(fileobj=io.BytesIO(_read_layout_blob(output, manifest["layers"][1]["digest"]))) as tar:
+            names = tar.getnames()
+            assert "app/.venv/lib/python3.11/site-packages/tinylib/__init__.py" in names
+            assert tar.getmember("app/.venv/bin/python").linkname == "/usr/local/bin/python3.11"
+            assert tar.extractfile("app/.venv/bin/tiny").read().startswith(b"#!/app/.venv/bin/python\n")
+            assert tar.extractfile("app/.venv/bin/tiny-tool").read() == b"#!/app/.venv/bin/python\nprint('tool')\n"
+            assert "app/.venv/bin/my-app" in names
+            assert not any("winlib" in name for name in names)
+        with tarfile.open(fileobj=io.BytesIO(_read_layout_blob(output, manifest["layers"][2]["digest"]))) as tar:
+            assert tar.getnames() == ["app", "app/my_app", "app/my_app/__init__.py"]
+
+        # layers are deterministic and cached, a second build gives the same image
+        assert build_oci_image(project, config) == output
+        with open(os.path.join(output, "index.json")) as f:
+            assert json.load(f)["manifests"][0]["digest"] == index["manifests"][0]["digest"]
+
+
+def _config(entrypoint: list[str]) -> ProjectConfiguration:
+    config = ProjectConfiguration()
+    config.image_name = "my-app"
+    config.image_tags = ["latest"]
+    config.entrypoint = entrypoint
+    config.labels = {}
+    config.engine = "oci"
+    config.runtime_base_image = "gcr.io/distroless/python3-debian12"
+    return config
+
+
+def test_check_oci_engine_supported() -> None:
+    check_oci_engine_supported(_config(["python", "-m", "app"]))
+    try:
+        check_oci_engine_supported(_config(["python -m app"]))
+        assert False
+    except ValueError as e:
+        assert str(e) == ("Runtime base image gcr.io/distroless/python3-debian12 has no shell, "
+                          "please specify 'entrypoint' as a list (exec format)")
+
+
+def test_watch_requires_docker_engine() -> None:
+    try:
+        build_full(None, _config(["python", "-m", "app"]), "/tmp")
+        assert False
+    except ValueError as e:
+        assert str(e) == 'watch requires engine = "docker", engine = "oci" doesn\'t load the image in docker'
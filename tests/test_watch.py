@@ -0,0 +1,95 @@
+import os
+import tarfile
+import tempfile
+
+from dockerpyze import watch as watch_module
+from dockerpyze.builder import ProjectConfiguration, get_image_targets
+from dockerpyze.watch import snapshot, classify_changes, generate_app_layer_context, watch
+
+
+def _config() -> ProjectConfiguration:
+    config = ProjectConfiguration()
+    config.image_name = "my-app"
+    config.image_tags = ["latest"]
+    config.entrypoint = ["python", "-m", "app"]
+    config.labels = {}
+    config.app_packages = ["app"]
+    config.deps_packages = ["libs/common"]
+    return config
+
+
+def _write(root: str, path: str, content: str = "") -> None:
+    os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+    with open(os.path.join(root, path), "w") as f:
+        f.write(content)
+
+
+def test_snapshot() -> None:
+    with tempfile.TemporaryDirectory() as root:
+        _write(root, "pyproject.toml")
+        _write(root, "app/__init__.py")
+        _write(root, "app/__pycache__/__init__.cpython-311.pyc")
+        _write(root, "libs/common/__init__.py")
+        _write(root, "tests/test_app.py")
+        assert sorted(snapshot(_config(), root)) == ["app/__init__.py", "libs/common/__init__.py", "pyproject.toml"]
+
+
+def test_classify_changes() -> None:
+    config = _config()
+    before = {"pyproject.toml": 1, "app/__init__.py": 1, "libs/common/__init__.py": 1}
+    assert classify_changes(config, before, dict(before)) is None
+    assert classify_changes(config, before, {**before, "app/__init__.py": 2}) == "app"
+    assert classify_changes(config, before, {**before, "app/main.py": 2}) == "app"
+    assert classify_changes(config, before, {**before, "pyproject.toml": 2}) == "full"
+    assert classify_changes(config, before, {**before, "poetry.lock": 2}) == "full"
+    assert classify_changes(config, before, {**before, "libs/common/__init__.py": 2}) == "full"
+    removed = dict(before)
+    removed.pop("app/__init__.py")
+    assert classify_changes(config, before, removed) == "full"
+
+
+def test_generate_app_layer_context() -> None:
+    with tempfile.TemporaryDirectory() as root:
+        _write(root, "pyproject.toml")
+        _write(root, "app/__init__.py")
+        _write(root, "libs/common/__init__.py")
+        config = _config()
+        context = generate_app_layer_context(config, get_image_targets(config)[0], root)
+        with tarfile.open(fileobj=context) as tar:
+            assert sorted(tar.getnames()) == ["Dockerfile", "app/__init__.py"]
+            assert tar.extractfile("Dockerfile").read().decode() == "FROM my-app:dpy-watch-base\nCOPY ./app /app/app\n"
+
+
+def test_watch_survives_invalid_pyproject(monkeypatch, capsys) -> None:
+    snapshots = iter([
+        {"pyproject.toml": 1},
+        # half-edited pyproject.toml, then fixed
+        {"pyproject.toml": 2}, {"pyproject.toml": 2},
+        {"pyproject.toml": 3}, {"pyproject.toml": 3},
+    ])
+
+    def next_snapshot(config, path):
+        try:
+            return next(snapshots)
+        except StopIteration:
+            raise KeyboardInterrupt()
+
+    parses = iter([_config(), ValueError("Invalid compression 'zst'"), _config()])
+
+    def parse(path):
+        result = next(parses)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    full_builds = []
+    monkeypatch.setattr(watch_module.docker, "from_env", lambda: None)
+    monkeypatch.setattr(watch_module, "parse_pyproject_toml", parse)
+    monkeypatch.setattr(watch_module, "build_full", lambda *args, **kwargs: full_builds.append(args))
+    monkeypatch.setattr(watch_module, "snapshot", next_snapshot)
+    monkeypatch.setattr(watch_module.time, "sleep", lambda seconds: None)
+    watch("/tmp")
+    assert len(full_builds) == 2
+    output = capsys.readouterr().out
+    assert "❌ Invalid compression 'zst'\nWaiting for changes to fix the build" in output
+    assert "Stopped watching" in output